@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+# Time rule selection over long runs of rules on the same selector, testing each rule in turn
+# versus testing the run with one combined regular expression.
+#
+#     PYTHONPATH=src python bench/bench_matching.py [num_rules...]
+
+from echoapi.dispatch_index import DispatchIndex
+from echoapi.request_facets import RequestFacets
+from echoapi.rules import compile_rules
+
+from box import Box
+
+import sys
+import timeit
+
+
+def run_spec(num_rules):
+    lines = []
+    for n in range(num_rules - 1):
+        kind = n % 3
+        if kind == 0:
+            lines.append(f"HEADER:X-Item /item-{n}\\b/ text:item {n}")
+        elif kind == 1:
+            lines.append(f"HEADER:X-Item /^sku-{n}/i text:sku {n}")
+        else:
+            lines.append(f"HEADER:X-Item !/^(?:item|sku|color)-/ text:unknown {n}")
+    lines.append(f"HEADER:X-Item /item-{num_rules - 1}\\b/ text:item {num_rules - 1}")
+    lines.append("text:not found")
+    return "\n".join(lines) + "\n"
+
+
+def first_match(rules, indexes, facets):
+    return next(index for index in indexes if rules[index].apply(facets, 1))
+
+
+def main(sizes):
+    print(f"{'rules':>8} {'us/loop':>10} {'us/fused':>10} {'speedup':>8}")
+    for num_rules in sizes:
+        compiled = compile_rules("bench.echo", 200, 0, 0, run_spec(num_rules))
+        rules, index = compiled.rules, DispatchIndex(compiled.rules)
+
+        # only the last rule in the run matches
+        facets = RequestFacets.of({"X-Item": f"item-{num_rules - 1}"}, {}, Box())
+        assert first_match(rules, range(len(rules)), facets) == first_match(rules, index.candidates(facets), facets)
+
+        number = max(1, 20000 // num_rules)
+        loop = timeit.timeit(lambda: first_match(rules, range(len(rules)), facets), number=number)
+        fused = timeit.timeit(lambda: first_match(rules, index.candidates(facets), facets), number=number)
+        loop_us, fused_us = loop * 1e6 / number, fused * 1e6 / number
+        print(f"{num_rules:>8} {loop_us:>10.1f} {fused_us:>10.1f} {loop_us / fused_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10, 100, 1000])
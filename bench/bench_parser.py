@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+
+# Time ResponseParser on large, catalog-like rules specifications, and the parser of an earlier commit on the
+# same specifications, to compare with, eg: the first commit, which parsed one line at a time.
+#
+#     PYTHONPATH=src python bench/bench_parser.py [--baseline REV] [--json] [num_rules...]
+
+from echoapi.response_parser import ResponseParser
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import timeit
+
+
+def catalog_spec(num_rules):
+    lines = ["200 delay=0ms", "# generated catalog", "----"]
+    for n in range(num_rules):
+        kind = n % 5
+        if kind == 0:
+            lines.append(f'PARAM:id /^{n}$/ text:{{ "id": {n}, "name": "item {n}" }}')
+        elif kind == 1:
+            lines.append(f"PATH: /catalog.item.{n}\\b/ 201 file:catalog/{n}.json")
+        elif kind == 2:
+            lines.append(f"JSON:item.sku /SKU-{n}/i delay=5ms")
+            lines.append("HEADER: Content-Type: application/json")
+            lines.append(f'{{ "sku": "SKU-{n}",')
+            lines.append(f'  "price": {n}.99 }}')
+        elif kind == 3:
+            lines.append(f"# item {n}")
+            lines.append(f"HEADER:X-Item /{n}/ after=10ms | text:header {n} | text:fallback")
+        else:
+            lines.append(f"PARAM:seq /{n}/")
+            lines.append("--[ 1 ]--")
+            lines.append(f"first {n}")
+            lines.append("--[ 2 ]--")
+            lines.append(f"file:seq/{n}.json")
+    lines.append("text:not found")
+    return "\n".join(lines) + "\n"
+
+
+def measure(sizes):
+    # num_rules -> milliseconds per parse
+    results = {}
+    for num_rules in sizes:
+        text = catalog_spec(num_rules)
+        number = max(1, 20000 // num_rules)
+        timer = timeit.Timer(lambda: ResponseParser("catalog.echo", 200, 0, 0).parse(text))
+        results[num_rules] = min(timer.repeat(repeat=3, number=number)) * 1000 / number
+    return results
+
+
+def measure_baseline(rev, sizes):
+    # runs this script with the src directory of rev, so both parsers are timed on the same specifications
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = subprocess.run(["git", "archive", rev, "src"], cwd=root, capture_output=True, check=True).stdout
+        subprocess.run(["tar", "-x", "-C", tmp], input=archive, check=True)
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--json", *map(str, sizes)],
+            env={**os.environ, "PYTHONPATH": os.path.join(tmp, "src")},
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+    return {int(num_rules): ms for num_rules, ms in json.loads(output).items()}
+
+
+def first_commit():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    revs = subprocess.run(["git", "rev-list", "--max-parents=0", "HEAD"], cwd=root, capture_output=True, text=True)
+    return revs.stdout.split()[-1]
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Benchmark ResponseParser")
+    parser.add_argument("sizes", nargs="*", type=int, help="numbers of rules, default 100 500 1000 5000")
+    parser.add_argument("--baseline", help="git revision to compare with, default the first commit")
+    parser.add_argument("--no-baseline", action="store_true", help="only time the current parser")
+    parser.add_argument("--json", action="store_true", help="print milliseconds per parse as json")
+    options = parser.parse_args(args)
+    sizes = options.sizes or [100, 500, 1000, 5000]
+
+    results = measure(sizes)
+    if options.json:
+        print(json.dumps(results))
+        return 0
+
+    baseline = {}
+    if not options.no_baseline:
+        try:
+            baseline = measure_baseline(options.baseline or first_commit(), sizes)
+        except (OSError, IndexError, subprocess.CalledProcessError) as e:
+            print(f"(no baseline: {getattr(e, 'stderr', None) or e})", file=sys.stderr)
+
+    print(f"{'rules':>8} {'lines':>8} {'ms/parse':>10} {'us/rule':>10} {'baseline ms':>12} {'speedup':>8}")
+    for num_rules, ms in results.items():
+        line = f"{num_rules:>8} {catalog_spec(num_rules).count(chr(10)):>8} {ms:>10.2f} {ms * 1000 / num_rules:>10.2f}"
+        if num_rules in baseline:
+            line += f" {baseline[num_rules]:>12.2f} {baseline[num_rules] / ms:>7.1f}x"
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+# Time the parse/match/render pipeline in process, through RulesTemplate.resolve and the Flask test client,
+# with synthetic rules specifications that each scale one thing: the number of rules, the depth of nested
+# files, the length of a sequence, the number of parameter references, or the size of the response body.
+# Records operations per second and the peak memory allocated by one operation, and saves them as a
+# baseline to compare later runs with.
+#
+#     PYTHONPATH=src python bench/bench_pipeline.py [--save FILE] [--compare FILE] [--tolerance 0.25] [name...]
+#
+# eg: save a baseline before a change, then compare after it, which exits with status 1 for a regression:
+#
+#     PYTHONPATH=src python bench/bench_pipeline.py --save /tmp/baseline.json
+#     PYTHONPATH=src python bench/bench_pipeline.py --compare /tmp/baseline.json
+
+from echoapi import rules_template
+from echoapi.include_graph import IncludeGraph
+from echoapi.response_files import ResponseFileStore
+from echoapi.routes import app
+from echoapi.rules import parse_rules
+from echoapi.rules_template import RulesTemplate
+
+from box import Box
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+
+def rules_spec(num_rules):
+    # only the last of the PARAM rules matches id=last
+    lines = [f"PARAM:id /^{n}$/ text:item {n}" for n in range(num_rules - 1)]
+    lines.append("PARAM:id /^last$/ text:last item")
+    lines.append("text:not found")
+    return "\n".join(lines) + "\n"
+
+
+def sequence_spec(length):
+    return "PARAM:id /./\n" + "".join(f"--[ {n + 1} ]--\nresponse {n}\n" for n in range(length))
+
+
+def refs_spec(num_refs):
+    return "PARAM:id /./ text:" + " ".join(f"{{p{n}}}" for n in range(num_refs)) + "\n"
+
+
+def write_nested_files(root, depth):
+    # level0.echo includes level1.echo and so on, each with a condition so none is a plain forward
+    for level in range(depth):
+        with open(os.path.join(root, f"depth{depth}-level{level}.echo"), "w") as fh:
+            fh.write(f"PARAM:id /./ file:depth{depth}-level{level + 1}.echo\ntext:no id\n")
+    with open(os.path.join(root, f"depth{depth}-level{depth}.echo"), "w") as fh:
+        fh.write("PARAM:id /last/ text:bottom {id}\n")
+    return f"file:depth{depth}-level0.echo"
+
+
+def write_body_file(root, num_bytes):
+    file = f"body-{num_bytes}.json"
+    with open(os.path.join(root, file), "w") as fh:
+        fh.write(("x" * 63 + "\n") * (num_bytes // 64))
+    return f"file:{file}"
+
+
+def benchmarks(root):
+    # name -> function doing one operation
+    params = {"id": "last", **{f"p{n}": f"value {n}" for n in range(100)}}
+
+    def resolve(text):
+        template = RulesTemplate("/bench", text)
+        return lambda: template.resolve(headers={}, params=params, json=Box())
+
+    def get(text, path="/bench"):
+        client = app.test_client()
+        query = {"id": "last", "_echo_response": text}
+        return lambda: client.get(path, query_string=query).get_data()
+
+    def parse(text):
+        return lambda: parse_rules("bench.echo", 200, 0, 0, text, True)
+
+    cases = {}
+    for num_rules in (10, 100, 1000):
+        cases[f"parse-rules-{num_rules}"] = parse(rules_spec(num_rules))
+        cases[f"resolve-rules-{num_rules}"] = resolve(rules_spec(num_rules))
+    for depth in (1, 4, 16):
+        cases[f"resolve-depth-{depth}"] = resolve(write_nested_files(root, depth))
+    for length in (1, 10, 100):
+        cases[f"resolve-sequence-{length}"] = resolve(sequence_spec(length))
+    for num_refs in (1, 10, 100):
+        cases[f"resolve-refs-{num_refs}"] = resolve(refs_spec(num_refs))
+    cases["client-rules-100"] = get(rules_spec(100))
+    cases["client-refs-10"] = get(refs_spec(10))
+    for num_bytes in (1024, 64 * 1024, 1024 * 1024):
+        cases[f"client-body-{num_bytes // 1024}kb"] = get(write_body_file(root, num_bytes))
+    return cases
+
+
+def measure(op):
+    op()  # compile and cache the rules, and load the files, before timing
+    timer = timeit.Timer(op)
+    number, _ = timer.autorange()
+    seconds = min(timer.repeat(repeat=3, number=number)) / number
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        op()
+        peak = tracemalloc.get_traced_memory()[1] - start
+    finally:
+        tracemalloc.stop()
+    return {"ops_per_sec": round(1 / seconds, 1), "alloc_peak_bytes": peak}
+
+
+def regressions(results, baseline, tolerance):
+    # names of the benchmarks that are slower, or allocate more, than the baseline by more than the tolerance
+    found = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["ops_per_sec"] < base["ops_per_sec"] * (1 - tolerance):
+            found.append(f"{name}: {result['ops_per_sec']:.0f} ops/sec, was {base['ops_per_sec']:.0f}")
+        if result["alloc_peak_bytes"] > base["alloc_peak_bytes"] * (1 + tolerance) + 1024:
+            found.append(f"{name}: {result['alloc_peak_bytes']} bytes, was {base['alloc_peak_bytes']}")
+    return found
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description="Benchmark the parse/match/render pipeline")
+    parser.add_argument("names", nargs="*", help="benchmarks to run, eg: resolve-rules-100, default all")
+    parser.add_argument("--save", help="save the results to this json file")
+    parser.add_argument("--compare", help="compare the results with this json file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed fraction slower or bigger")
+    options = parser.parse_args(args)
+
+    baseline = {}
+    if options.compare:
+        with open(options.compare) as fh:
+            baseline = json.load(fh)["benchmarks"]
+
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        # response files are written to, and loaded from, a temporary directory
+        rules_template.include_graph = IncludeGraph(ResponseFileStore(root, 64 * 1024 * 1024, 1000, 256 * 1024))
+        cases = benchmarks(root)
+        unknown = set(options.names) - cases.keys()
+        if unknown:
+            parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+        print(f"{'benchmark':<24} {'ops/sec':>12} {'peak KB':>10} {'vs baseline':>12}")
+        for name, op in cases.items():
+            if options.names and name not in options.names:
+                continue
+            results[name] = result = measure(op)
+            base = baseline.get(name)
+            change = f"{result['ops_per_sec'] / base['ops_per_sec']:>11.2f}x" if base else ""
+            print(f"{name:<24} {result['ops_per_sec']:>12.1f} {result['alloc_peak_bytes'] / 1024:>10.1f} {change}")
+
+    if options.save:
+        with open(options.save, "w") as fh:
+            json.dump({"python": platform.python_version(), "benchmarks": results}, fh, indent=2)
+
+    found = regressions(results, baseline, options.tolerance)
+    for regression in found:
+        print(f"REGRESSION: {regression}")
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
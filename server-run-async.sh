@@ -0,0 +1,2 @@
+#!/bin/bash
+uvicorn src.echoapi.asgi:app --host 0.0.0.0 --port 5000
@@ -0,0 +1,5 @@
+#!/bin/bash
+# rule match counts are shared by the worker processes through the state file, which starts out empty
+export ECHO_API_STATE_FILE=${ECHO_API_STATE_FILE:-/tmp/echoapi-state.db}
+rm -f "$ECHO_API_STATE_FILE" "$ECHO_API_STATE_FILE-wal" "$ECHO_API_STATE_FILE-shm"
+gunicorn -w ${ECHO_API_WORKERS:-$(nproc)} --threads ${ECHO_API_THREADS:-4} -b 0.0.0.0:5000 src.echoapi.routes:app
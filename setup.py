@@ -17,8 +17,16 @@ setup(
         "python-box == 6.0.2",
         "requests == 2.28.1",
     ],
-    # for testing only
     extras_require={
+        # for serving with asyncio, see server-run-async.sh
+        "async": [
+            "uvicorn == 0.22.0",
+        ],
+        # for serving with multiple worker processes, see server-run-prod.sh
+        "prod": [
+            "gunicorn == 20.1.0",
+        ],
+        # for testing only
         "test": [
             "black == 22.3.0",
             "coverage >= 5.5",
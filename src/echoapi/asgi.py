@@ -0,0 +1,118 @@
+from .routes import app as wsgi_app, DEFER_DELAY, DELAY
+
+import asyncio
+import io
+import sys
+
+
+class AsgiApp:
+    """
+    ASGI interface to the echo server, eg: uvicorn src.echoapi.asgi:app
+
+    Each request is handled by the Flask app in a worker thread, so matching rules and reading files
+    does not block the event loop.  A delayed response is then held with an event loop timer rather
+    than a sleeping thread, so any number of delayed responses may be outstanding at once.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            await self.http(scope, receive, send)
+        elif scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        else:
+            raise ValueError(f"unsupported ASGI scope type: {scope['type']}")
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def http(self, scope, receive, send):
+        body = await self.read_body(receive)
+        environ = self.environ(scope, body)
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+        chunks = await asyncio.to_thread(self.wsgi_app, environ, start_response)
+        try:
+            # a file is only read after the delay, so it is not held in memory while waiting
+            delay = environ.get(DELAY)
+            if delay:
+                await asyncio.sleep(delay / 1000)
+
+            await send({"type": "http.response.start", "status": response["status"], "headers": response["headers"]})
+            # each chunk may be read from a file, so it is produced in a worker thread too
+            chunk_iter = iter(chunks)
+            while True:
+                chunk = await asyncio.to_thread(next, chunk_iter, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(chunks, "close"):
+                await asyncio.to_thread(chunks.close)
+
+    @staticmethod
+    async def read_body(receive):
+        parts = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            parts.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        return b"".join(parts)
+
+    @staticmethod
+    def environ(scope, body):
+        server_name, server_port = scope.get("server") or ("localhost", 80)
+        client_addr, _ = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server_name,
+            "SERVER_PORT": str(server_port),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": client_addr,
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+            DEFER_DELAY: True,
+        }
+
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+                key = name
+            else:
+                key = f"HTTP_{name}"
+            if key in environ:
+                # repeated headers are joined with commas, except cookies, which are joined as in one header
+                value = environ[key] + ("; " if key == "HTTP_COOKIE" else ",") + value
+            environ[key] = value
+
+        return environ
+
+
+app = AsgiApp(wsgi_app)
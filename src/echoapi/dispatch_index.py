@@ -0,0 +1,177 @@
+from .placeholders import ref_pat
+
+import re
+
+
+# characters that make a regular expression more than a literal string
+metachars = frozenset(".^$*+?{}[]|()")
+
+# minimum number of exact-match rules on the same selector worth a hash lookup
+min_group_size = 4
+
+# minimum number of consecutive rules on the same selector worth combining into one regular expression
+min_run_size = 4
+
+# longest text tested with a combined regular expression, beyond which separate searches are faster,
+# since the combined expression tries every rule's pattern at every position of the text
+max_fused_text_length = 32
+
+# constructs that depend on group numbering or on flags for the whole expression, which cannot be combined
+unfusable_pat = re.compile(r"\\[1-9]|\(\?P?[<=(]|\(\?[aiLmsux-]")
+
+
+def exact_literal(rule):
+    # the text a rule's pattern matches exactly, eg: "1234" for /^1234$/, or None if it is not that simple
+    if rule.regex is None or not rule.is_positive or rule.regex.flags & re.IGNORECASE:
+        return None
+    if not is_selector_fixed(rule):
+        return None
+
+    expr = rule.regex.pattern
+    if len(expr) < 2 or expr[0] != "^" or expr[-1] != "$":
+        return None
+
+    chars = []
+    i, end = 1, len(expr) - 1
+    while i < end:
+        c = expr[i]
+        if c == "\\":
+            i += 1
+            if i == end or expr[i].isalnum():  # eg: \d, or an escaped $ at the end
+                return None
+            c = expr[i]
+        elif c in metachars:
+            return None
+        chars.append(c)
+        i += 1
+    return "".join(chars)
+
+
+def is_selector_fixed(rule):
+    return rule.selector_type is not None and not (rule.selector_target and ref_pat.search(rule.selector_target))
+
+
+def is_fusable(rule):
+    return rule.regex is not None and is_selector_fixed(rule) and not unfusable_pat.search(rule.regex.pattern)
+
+
+class FusedRun:
+    """Consecutive rules on the same selector, tested with one combined regular expression"""
+
+    def __init__(self, rules, start, end):
+        self.start = start
+        self.end = end
+        self.rule = rules[start]
+
+        # at the start of the text, the first alternative whose lookahead succeeds is the first matching rule
+        alternatives = []
+        for index in range(start, end):
+            regex = rules[index].regex
+            flags = "i" if regex.flags & re.IGNORECASE else "-i"
+            lookahead = "=" if rules[index].is_positive else "!"
+            alternatives.append(f"(?{lookahead}[\\s\\S]*?(?{flags}:{regex.pattern}))(?P<r{index}>)")
+        self.regex = re.compile("|".join(alternatives))
+
+    def candidates(self, facets):
+        try:
+            text = self.rule._text(facets)
+        except Exception:
+            text = None
+        if not isinstance(text, str) or len(text) > max_fused_text_length:
+            yield from range(self.start, self.end)
+            return
+
+        match_obj = self.regex.match(text)
+        if match_obj:
+            # later rules in the run are only tested if the first match is not selected, eg: due to "after"
+            yield from range(int(match_obj.lastgroup[1:]), self.end)
+
+
+class DispatchIndex:
+    """Finds the rules that might match a request, without testing every rule"""
+
+    def __init__(self, rules):
+        self.num_rules = len(rules)
+        self.groups = {}  # (selector type, target) -> (first rule, {literal: [rule index,...]}, [rule index,...])
+
+        literals = [exact_literal(rule) for rule in rules]
+        by_selector = {}
+        for index, (rule, literal) in enumerate(zip(rules, literals)):
+            if literal is not None:
+                by_selector.setdefault((rule.selector_type, rule.selector_target), []).append(index)
+
+        indexed = set()
+        for selector, indexes in by_selector.items():
+            if len(indexes) < min_group_size:
+                continue
+            lookup = {}
+            for index in indexes:
+                lookup.setdefault(literals[index], []).append(index)
+            self.groups[selector] = (rules[indexes[0]], lookup, indexes)
+            indexed.update(indexes)
+
+        self.scanned = []  # rule indexes tested one by one, and runs of rules tested together
+        self.num_runs = 0
+        self.add_runs(rules, indexed)
+
+    def add_runs(self, rules, indexed):
+        # runs of rules on the same selector that are not in a group, each tested with one regex if long enough
+        index = 0
+        while index < len(rules):
+            end = index
+            if index not in indexed and is_fusable(rules[index]):
+                selector = (rules[index].selector_type, rules[index].selector_target)
+                while (
+                    end < len(rules)
+                    and end not in indexed
+                    and is_fusable(rules[end])
+                    and (rules[end].selector_type, rules[end].selector_target) == selector
+                ):
+                    end += 1
+            if end - index >= min_run_size and self.add_run(rules, index, end):
+                index = end
+            else:
+                if index not in indexed:
+                    self.scanned.append(index)
+                index += 1
+
+    def add_run(self, rules, start, end):
+        try:
+            self.scanned.append(FusedRun(rules, start, end))
+        except re.error:
+            return False
+        self.num_runs += 1
+        return True
+
+    def candidates(self, facets):
+        # indexes of the rules to test, in order, so the first matching rule is still the one selected
+        if not self.groups and not self.num_runs:
+            return range(self.num_rules)
+
+        entries = self.scanned + self.lookup(facets)
+        entries.sort(key=lambda entry: entry if isinstance(entry, int) else entry.start)
+        return self.expand(entries, facets)
+
+    @staticmethod
+    def expand(entries, facets):
+        for entry in entries:
+            if isinstance(entry, int):
+                yield entry
+            else:
+                yield from entry.candidates(facets)
+
+    def lookup(self, facets):
+        indexes = []
+        for rule, lookup, group in self.groups.values():
+            try:
+                text = rule._text(facets)
+            except Exception:
+                text = None
+            if not isinstance(text, str):
+                # eg: a missing json field, left to fail when the rules are tested, as if scanned
+                indexes += group
+                continue
+            indexes += lookup.get(text, ())
+            if text.endswith("\n"):  # $ also matches before a final newline
+                indexes += lookup.get(text[:-1], ())
+        return indexes
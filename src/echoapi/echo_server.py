@@ -1,67 +1,62 @@
+from .response_files import StaticFile
+from .request_facets import RequestFacets
 from .rules_template import RulesTemplate
+from .timing import new_timer, timings
 
-from box import Box
 from flask import request, Response
+from werkzeug.wsgi import wrap_file
 
+import os
 import re
 
 
 class EchoServer:
 
-    param_pat = re.compile(r"^(\w+):(.*)$")
     param_value_pat = re.compile(r":\w+")
 
     def __init__(self, path):
-        self.parse_headers()
-        self.parse_request_path(path)
-        self.parse_response_parameter()
-        self.parse_json_body()
-
-    def parse_headers(self):
-        self.headers = None  # Box of request headers
-        headers = {}
-        for header in request.headers.keys():
-            headers[header] = request.headers.get(header)
-        self.headers = Box(headers)
-
-    def parse_request_path(self, path):
         self.path = path  # the request path
-        self.path_params = {}  # params parsed from path
-
-        parts = path.split("/")
-        for part in parts:
-            m = self.param_pat.search(part)
-            if m:
-                name, value = m.group(1), m.group(2)
-                self.path_params[name] = value
-
-    def parse_response_parameter(self):
-        echo_response = request.args.get("_echo_response", "")
-        self.content = echo_response.lstrip()
-
-    def parse_json_body(self):
-        self.json = None  # Box of json object from the request body
-
-        try:
-            json = request.get_json()
-        except Exception:
-            json = {}
-
-        self.json = Box(json)
-
-    def all_params(self):
-        params = {k: v for k, v in request.args.items()}
-        return {**self.path_params, **params}
+        self.content = request.args.get("_echo_response", "").lstrip()
+        self.request_path = re.sub(self.param_value_pat, "", path)
+        self.timer = new_timer()  # a Timer if timing is enabled, else a stand in that does nothing
+        self.facets = RequestFacets(path, self.timer)  # headers, params and json are only decoded if the rules use them
+        self.rule_ids = []  # of the rules selected for the response
 
     def response(self):
-        content = self.content
-        headers = self.headers
-        params = self.all_params()
-        json = self.json
-
-        request_path = re.sub(self.param_value_pat, "", self.path)
-        template = RulesTemplate(request_path, content)
-        delay, status, headers, content = template.resolve(headers, params, json)
-        resp = Response(content, headers=headers, status=status)
-
+        template = RulesTemplate(self.request_path, self.content)
+        self.rule_ids = template.rule_ids
+        delay, status, headers, content = template.resolve_response(self.facets)
+        if isinstance(content, StaticFile):
+            resp = self.static_file_response(content, headers, status)
+        else:
+            resp = Response(content, headers=headers, status=status)
+
+        etag = getattr(content, "etag", None)
+        if etag is not None and status == 200 and "ETag" not in resp.headers:
+            resp = self.conditional_response(resp, etag, content.last_modified)
         return delay, resp
+
+    def conditional_response(self, resp, etag, last_modified):
+        # content reused across requests has an ETag, so a client that already has it gets a 304 with no body
+        resp.set_etag(etag)
+        if last_modified is not None and "Last-Modified" not in resp.headers:
+            resp.last_modified = last_modified
+        resp.make_conditional(request)
+        if resp.status_code == 304 and resp.direct_passthrough:
+            resp.response.close()
+            resp.response = []
+        return resp
+
+    def static_file_response(self, static_file, headers, status):
+        # let the WSGI server send the file directly (eg, with sendfile), rather than reading it into memory
+        fh = static_file.open()
+        size = os.fstat(fh.fileno()).st_size
+        body = wrap_file(request.environ, fh)
+        resp = Response(body, headers=headers, status=status, direct_passthrough=True)
+        resp.content_length = size
+        return resp
+
+    def record_timing(self, resp):
+        self.timer.stop()
+        resp.headers["Server-Timing"] = self.timer.server_timing()
+        timings.record(self.request_path, self.timer)
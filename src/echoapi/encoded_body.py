@@ -0,0 +1,17 @@
+import hashlib
+
+
+class EncodedBody(bytes):
+    """Response content that is reused across requests, with a strong ETag computed on first use"""
+
+    def __new__(cls, data, last_modified=None):
+        body = super().__new__(cls, data)
+        body.last_modified = last_modified  # seconds since the epoch, for content read from a response file
+        body._etag = None
+        return body
+
+    @property
+    def etag(self):
+        if self._etag is None:
+            self._etag = hashlib.blake2b(self, digest_size=16).hexdigest()
+        return self._etag
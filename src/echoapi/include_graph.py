@@ -0,0 +1,132 @@
+from .placeholders import ref_pat
+from .response_files import response_files, ResponseFile
+from .rule import RuleError
+from .rules import parse_rules
+
+import threading
+import typing
+
+
+class IncludeCycleError(RuleError):
+    pass
+
+
+class IncludeNode(typing.NamedTuple):
+
+    entry: ResponseFile  # the version of the file the includes were found in
+    includes: tuple  # files named by file: locations without parameter references
+    forward: str  # the only thing the file does is include this file, else None
+
+
+def static_includes(file, text):
+    compiled = parse_rules(file, 200, 0, 0, text, True)
+    includes = []
+    for rule in compiled.rules:
+        for entry in rule.sequence:
+            for location, value in entry.contents:
+                if location == "file" and not ref_pat.search(value):
+                    includes.append(value.strip())
+
+    return tuple(includes), forward_target(file, text, compiled.rules)
+
+
+def forward_target(file, text, rules):
+    # a file with one unconditional rule that includes another file, and inherits everything else
+    if len(rules) != 1 or len(includes_of(rules[0])) != 1:
+        return None
+    rule = rules[0]
+    if (
+        rule.selector_type is not None
+        or rule.sequence[0].headers
+        or (rule.status_code, rule.delay, rule.after) != (200, 0, 0)
+    ):
+        return None
+
+    # the status code, delay, and after value must come from whoever includes the file, not from the file itself
+    other = parse_rules(file, 201, 1, 1, text, True).rules[0]
+    if (other.status_code, other.delay, other.after) != (201, 1, 1):
+        return None
+    return includes_of(rule)[0]
+
+
+def includes_of(rule):
+    if len(rule.sequence) != 1 or len(rule.sequence[0].contents) != 1:
+        return ()
+    location, value = rule.sequence[0].contents[0]
+    if location != "file" or ref_pat.search(value):
+        return ()
+    return (value.strip(),)
+
+
+class IncludeGraph:
+    """Files included by .echo files, checked for cycles when each file is loaded"""
+
+    def __init__(self, files):
+        self.files = files  # ResponseFileStore
+        self.nodes = {}  # file -> IncludeNode, for files with no include cycle
+        self.lock = threading.Lock()
+
+    def load(self, file):
+        # like ResponseFileStore.load(), but raises IncludeCycleError for a file that ends up including itself
+        entry = self.files.load(file)
+        if isinstance(entry, ResponseFile) and entry.text is not None:
+            node = self.nodes.get(file)
+            if node is None or node.entry is not entry:
+                self.check(file, entry)
+        return entry
+
+    def check(self, file, entry):
+        # depth first search of the files reachable from this one, which are only added if there is no cycle
+        found = {file: IncludeNode(entry, *static_includes(file, entry.text))}
+        done = set()  # files all of whose includes have been searched
+        path = [file]
+        stack = [iter(found[file].includes)]
+        while stack:
+            include = next(stack[-1], None)
+            if include is None:
+                stack.pop()
+                done.add(path.pop())
+                continue
+            if include in done:
+                continue
+            if include in path:
+                cycle = " -> ".join(path[path.index(include) :] + [include])
+                raise IncludeCycleError(f"include cycle: {cycle}")
+
+            node = found.get(include) or self.node(include)
+            if node is not None:
+                found[include] = node
+                path.append(include)
+                stack.append(iter(node.includes))
+
+        with self.lock:
+            self.nodes.update(found)
+
+    def node(self, file):
+        try:
+            entry = self.files.load(file)
+        except OSError:
+            return None  # reported when the file is used
+        if not isinstance(entry, ResponseFile) or entry.text is None:
+            return None
+        node = self.nodes.get(file)
+        if node is None or node.entry is not entry:
+            try:
+                node = IncludeNode(entry, *static_includes(file, entry.text))
+            except IncludeCycleError:
+                raise
+            except RuleError:
+                return None  # eg: an invalid pattern, reported when the file is used
+        return node
+
+    def forward(self, file):
+        # the file at the end of a chain of files that only include the next one, eg: "kingdom/animalia.echo"
+        while True:
+            self.load(file)
+            node = self.nodes.get(file)
+            if node is None or node.forward is None:
+                return file
+            file = node.forward
+
+
+include_graph = IncludeGraph(response_files)
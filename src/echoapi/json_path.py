@@ -0,0 +1,57 @@
+from box import Box
+
+import functools
+import re
+
+
+# eg: "pet", ".dog", "[0]"
+step_pat = re.compile(r"\[(\d+)\]|\.?([^.\[]+)")
+
+# marks a path that cannot be walked directly, so it is formatted as before
+missing = object()
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_path(path):
+    # the keys and indexes of a json path, eg: ("pets", 0, "name") from "pets[0].name"
+    if path.startswith("."):
+        return None
+    steps = []
+    pos = 0
+    while pos < len(path):
+        m = step_pat.match(path, pos)
+        if not m or m.end() == pos:
+            return None
+        steps.append(int(m.group(1)) if m.group(1) is not None else m.group(2))
+        pos = m.end()
+    return tuple(steps)
+
+
+def walk(json, steps):
+    value = json
+    for step in steps:
+        if isinstance(value, dict) and not isinstance(step, int):
+            value = value.get(step, missing)
+        elif isinstance(value, list) and (isinstance(step, int) or step.isdigit()):
+            index = int(step)
+            value = value[index] if index < len(value) else missing
+        else:
+            return missing
+        if value is missing:
+            return missing
+    return value
+
+
+def format_path(json, path):
+    # the original way of getting a value, with Box attribute access, which raises an error for a missing field
+    fmt = "{json." + path + "}"
+    return fmt.format(json=json if isinstance(json, Box) else Box(json))
+
+
+def json_text(json, path):
+    # the text of the value at a json path, eg: "Fido" for "pet.dog.name"
+    steps = compile_path(path)
+    value = missing if steps is None else walk(json, steps)
+    if value is missing:
+        return format_path(json, path)
+    return format(value)
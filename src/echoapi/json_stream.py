@@ -0,0 +1,131 @@
+from .json_path import compile_path, missing, walk
+
+import json
+import re
+
+
+decoder = json.JSONDecoder()
+scanstring = json.decoder.scanstring
+whitespace_pat = re.compile(r"[ \t\n\r]*")
+
+# key in a path tree for the paths ending at a node
+ends = object()
+
+
+class Found(Exception):
+    """Raised to stop scanning once every path has been found"""
+
+
+class JsonExtractor:
+    """Pulls the values at a few json paths out of a json document, without decoding the rest of it"""
+
+    def __init__(self, paths):
+        self.tree = {}  # step -> subtree, with the paths ending at each node under the ends key
+        self.values = {}  # path -> value
+        self.num_paths = 0
+        for path in set(paths):
+            steps = compile_path(path)
+            if steps is None:
+                continue
+            node = self.tree
+            for step in steps:
+                node = node.setdefault(step, {})
+            node.setdefault(ends, []).append(path)
+            self.num_paths += 1
+
+    def extract(self, text):
+        # returns {path: value} for the paths found, raises ValueError if the json is invalid before all are found
+        if self.num_paths:
+            try:
+                self.scan(text, 0, self.tree)
+            except Found:
+                pass
+        return self.values
+
+    def scan(self, text, pos, node):
+        # returns the position after the value at pos
+        pos = whitespace_pat.match(text, pos).end()
+        if ends in node:
+            value, end = decoder.raw_decode(text, pos)
+            self.found(node, value, ())
+            return end
+
+        c = text[pos : pos + 1]
+        if c == "{":
+            return self.scan_object(text, pos + 1, node)
+        if c == "[":
+            return self.scan_array(text, pos + 1, node)
+        return decoder.raw_decode(text, pos)[1]
+
+    def scan_or_skip(self, text, pos, node):
+        if node:
+            return self.scan(text, pos, node)
+        return decoder.raw_decode(text, whitespace_pat.match(text, pos).end())[1]
+
+    def scan_object(self, text, pos, node):
+        pos = whitespace_pat.match(text, pos).end()
+        if text[pos : pos + 1] == "}":
+            return pos + 1
+        while True:
+            if text[pos : pos + 1] != '"':
+                raise ValueError(f"expected a key at {pos}")
+            key, pos = scanstring(text, pos + 1)
+            pos = whitespace_pat.match(text, pos).end()
+            if text[pos : pos + 1] != ":":
+                raise ValueError(f"expected ':' at {pos}")
+            pos = self.scan_or_skip(text, pos + 1, node.get(key))
+            pos, is_last = self.next_member(text, pos, "}")
+            if is_last:
+                return pos
+
+    def scan_array(self, text, pos, node):
+        pos = whitespace_pat.match(text, pos).end()
+        if text[pos : pos + 1] == "]":
+            return pos + 1
+        index = 0
+        while True:
+            pos = self.scan_or_skip(text, pos, self.merge(node.get(index), node.get(str(index))))
+            pos, is_last = self.next_member(text, pos, "]")
+            if is_last:
+                return pos
+            index += 1
+
+    @staticmethod
+    def next_member(text, pos, close):
+        # returns the position after the separator, and whether it closed the object or array
+        pos = whitespace_pat.match(text, pos).end()
+        c = text[pos : pos + 1]
+        if c == ",":
+            return whitespace_pat.match(text, pos + 1).end(), False
+        if c == close:
+            return pos + 1, True
+        raise ValueError(f"expected ',' or '{close}' at {pos}")
+
+    @staticmethod
+    def merge(node, other):
+        # eg: the subtrees for "pets[0]" and "pets.0", which both index a list
+        if not node or not other:
+            return node or other
+        merged = dict(node)
+        for step, child in other.items():
+            if step is ends:
+                merged[ends] = node.get(ends, []) + child
+            else:
+                merged[step] = JsonExtractor.merge(merged.get(step), child)
+        return merged
+
+    def found(self, node, value, steps):
+        # record the value for the paths ending here, and any paths below it, which are walked in the value
+        for path in node.get(ends, ()):
+            self.values[path] = walk(value, steps)
+        for step, child in node.items():
+            if step is not ends:
+                self.found(child, value, steps + (step,))
+        if len(self.values) == self.num_paths:
+            raise Found()
+
+
+def extract(text, paths):
+    # the values at the given json paths, missing from the result if not in the document
+    values = JsonExtractor(paths).extract(text)
+    return {path: value for path, value in values.items() if value is not missing}
@@ -0,0 +1,126 @@
+from .response_files import response_files
+from .rules_cache import rules_cache
+from .timing import bucket_bounds
+
+import bisect
+import threading
+
+
+class ThreadCounters:
+    """Counts made by one thread, which only that thread updates"""
+
+    def __init__(self):
+        self.thread = threading.current_thread()
+        self.counts = {}  # (metric name, label value) -> count
+        self.latency_counts = [0] * (len(bucket_bounds) + 1)
+        self.latency_sum = 0.0  # seconds
+
+    def add_to(self, totals):
+        for key, count in self.counts.copy().items():
+            totals.counts[key] = totals.counts.get(key, 0) + count
+        for index, count in enumerate(self.latency_counts):
+            totals.latency_counts[index] += count
+        totals.latency_sum += self.latency_sum
+
+
+class Metrics:
+    """Request counters kept by each thread without locking, and added up when scraped"""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.threads = []  # ThreadCounters of the threads that are running, or were when the last one was added
+        self.retired = ThreadCounters()  # counts of the threads that have finished
+        self.lock = threading.Lock()  # taken once by each thread, to add its counters, and briefly to scrape
+
+    def counters(self):
+        counters = getattr(self.local, "counters", None)
+        if counters is None:
+            counters = self.local.counters = ThreadCounters()
+            with self.lock:
+                self.retire_finished()
+                self.threads.append(counters)
+        return counters
+
+    def retire_finished(self):
+        # called with the lock held, eg: the Flask development server starts a thread for each request, so the
+        # counters of finished threads, which no longer change, are added to one total rather than kept
+        running = []
+        for counters in self.threads:
+            if counters.thread.is_alive():
+                running.append(counters)
+            else:
+                counters.add_to(self.retired)
+        self.threads = running
+
+    def count(self, name, label):
+        counts = self.counters().counts
+        key = (name, label)
+        counts[key] = counts.get(key, 0) + 1
+
+    def request_done(self, status_code, seconds):
+        counters = self.counters()
+        key = ("requests", str(status_code))
+        counters.counts[key] = counters.counts.get(key, 0) + 1
+        counters.latency_counts[bisect.bisect_left(bucket_bounds, seconds * 1000)] += 1
+        counters.latency_sum += seconds
+
+    def totals(self):
+        totals = ThreadCounters()
+        with self.lock:
+            self.retire_finished()
+            running = list(self.threads)
+            self.retired.add_to(totals)
+        for counters in running:
+            counters.add_to(totals)
+        return totals
+
+    def exposition(self):
+        # the Prometheus text format, see https://prometheus.io/docs/instrumenting/exposition_formats/
+        totals = self.totals()
+        lines = []
+
+        def counter(name, help, label_name, key):
+            lines.extend([f"# HELP {name} {help}", f"# TYPE {name} counter"])
+            for (metric, label), count in sorted(totals.counts.items()):
+                if metric == key:
+                    lines.append(f'{name}{{{label_name}="{escape(label)}"}} {count}')
+
+        counter("echoapi_requests_total", "Requests by response status code.", "status", "requests")
+        counter("echoapi_rule_matches_total", "Matches of each rule, by rule id.", "rule", "rule")
+        counter("echoapi_response_file_uses_total", "Uses of each response file.", "file", "file")
+
+        name = "echoapi_request_duration_seconds"
+        lines.extend([f"# HELP {name} Time to handle a request, including any delay.", f"# TYPE {name} histogram"])
+        cumulative = 0
+        for bound, count in zip(bucket_bounds + (None,), totals.latency_counts):
+            cumulative += count
+            le = "+Inf" if bound is None else repr(bound / 1000)
+            lines.append(f'{name}_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum {totals.latency_sum!r}")
+        lines.append(f"{name}_count {cumulative}")
+
+        caches = (
+            ("rules_cache", rules_cache.stats(), {"size": "entries"}),
+            ("response_files", response_files.stats(), {"files": "entries", "bytes": "bytes"}),
+        )
+        for cache, stats, gauges in caches:
+            for stat in ("hits", "misses", "reloads", "evictions"):
+                if stat in stats:
+                    name = f"echoapi_{cache}_{stat}_total"
+                    lines.extend([f"# TYPE {name} counter", f"{name} {stats[stat]}"])
+            for stat, gauge in gauges.items():
+                name = f"echoapi_{cache}_{gauge}"
+                lines.extend([f"# TYPE {name} gauge", f"{name} {stats[stat]}"])
+            lookups = stats["hits"] + stats["misses"] + stats.get("reloads", 0)
+            hit_ratio = stats["hits"] / lookups if lookups else 0.0
+            name = f"echoapi_{cache}_hit_ratio"
+            lines.extend([f"# TYPE {name} gauge", f"{name} {hit_ratio!r}"])
+
+        return "\n".join(lines) + "\n"
+
+
+def escape(label):
+    return label.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
@@ -0,0 +1,160 @@
+import functools
+import re
+
+
+# eg: {color}, {json.pet.dog.name}, {header.Content-Type}
+ref_pat = re.compile(r"{(\w*([.-]\w*)*)}")
+# eg: "|{kind}" or "@ {name}", a reference that might complete a marker and keyword
+marked_ref_pat = re.compile(r"[|@>]\s*" + ref_pat.pattern)
+
+comment_pat = re.compile(r"\s*#")
+
+# words with special meaning at the beginning of a line to ResponseParser or RulesAdjuster
+keywords = ("HEADER", "PATH", "PARAM", "JSON", "BODY", "text", "file", "delay", "after")
+
+# characters splitlines() breaks on
+line_breaks = "\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029"
+
+# values that would change how the rules specification is parsed, if substituted before parsing
+# eg: "|text:" in a value would start another rule on the line
+marker_keyword = r"[|@>]\s*(HEADER|PATH|PARAM|JSON|BODY|text|file):"
+unsafe_target_pat = re.compile(r"^$|[\s/!]|" + marker_keyword)
+unsafe_pattern_pat = re.compile(f"[/{line_breaks}]|{marker_keyword}")
+unsafe_header_pat = re.compile(f"[:{line_breaks}]|^\\s|\\s$")
+unsafe_content_pat = re.compile(f"[{line_breaks}]|(HEADER|PATH|PARAM|JSON|BODY|text|file):|[|@>]\\s*$")
+
+
+def is_inert_prefix(prefix):
+    # text at the beginning of a line that cannot be extended into a rule, option, comment, or marker
+    if not prefix or prefix[0] in "0123456789#-|@>":
+        return False
+    return not any(prefix.startswith(keyword) or keyword.startswith(prefix) for keyword in keywords)
+
+
+class Template:
+    """Text split into literal segments and parameter references, to be rendered without searching it again"""
+
+    def __init__(self, text):
+        self.text = text
+        self.literals = []  # text between references, with one more literal than references
+        self.refs = []  # eg: "color", "json.pet.dog.name"
+        pos = 0
+        for match_obj in ref_pat.finditer(text):
+            self.literals.append(text[pos : match_obj.start()])
+            self.refs.append(match_obj.group(1))
+            pos = match_obj.end()
+        self.literals.append(text[pos:])
+        self.encoded_text = text.encode()
+        self.encoded_literals = [literal.encode() for literal in self.literals] if self.refs else None
+
+    def render(self, lookup):
+        # the text with each reference replaced by lookup(ref)
+        if not self.refs:
+            return self.text
+        parts = [self.literals[0]]
+        for ref, literal in zip(self.refs, self.literals[1:]):
+            parts.append(lookup(ref))
+            parts.append(literal)
+        return "".join(parts)
+
+    def encode(self, lookup):
+        # like render(), but encoded, reusing the encoded literals
+        if not self.refs:
+            return self.encoded_text
+        parts = [self.encoded_literals[0]]
+        for ref, literal in zip(self.refs, self.encoded_literals[1:]):
+            parts.append(lookup(ref).encode())
+            parts.append(literal)
+        return b"".join(parts)
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_template(source):
+    # source is a text, or a tuple of lines, eg: rule values
+    return Template(source if isinstance(source, str) else "".join(source))
+
+
+class Renderer:
+    """Substitutes request values for the parameter references left in parsed rules"""
+
+    def __init__(self, values=None):
+        self.values = values or {}  # ref -> value
+
+    def __call__(self, text):
+        if not self.values or not text or "{" not in text:
+            return text
+        return compile_template(text).render(self.values.__getitem__)
+
+    def encode(self, lines):
+        # the joined lines, substituted and encoded
+        template = compile_template(lines)
+        if not self.values:
+            return template.encoded_text
+        return template.encode(self.values.__getitem__)
+
+
+no_render = Renderer()
+
+
+class Placeholders:
+    """Parameter references left in a rules specification parsed before substitution"""
+
+    def __init__(self, text, rules):
+        self.is_bindable = True  # false if a reference might affect the structure of the rules
+        self.checks = {}  # ref -> patterns a value must not match to be substituted after parsing
+        self.scan(text, rules)
+
+    def scan(self, text, rules):
+        # a reference after a marker, eg: "|{kind}PARAM:x", might complete a keyword, and one in a comment is
+        # ignored by the parser unless its value has a line break, so both are resolved before parsing
+        if marked_ref_pat.search(text):
+            self.is_bindable = False
+        for line in text.splitlines():
+            if comment_pat.match(line) and ref_pat.search(line):
+                self.is_bindable = False
+
+        # the rest must all be found in some rule
+        expected = len(ref_pat.findall(text))
+
+        found = 0
+        for rule in rules:
+            found += self.add(rule.selector_target, unsafe_target_pat)
+            found += self.add(rule.pattern, unsafe_pattern_pat)
+            for entry in rule.sequence:
+                for name, value in entry.headers:
+                    found += self.add(name, unsafe_header_pat)
+                    found += self.add(value, unsafe_header_pat)
+                for location, value in entry.contents:
+                    for line in (value,) if location == "file" else value:
+                        found += self.add_content(line)
+
+        if found != expected:
+            self.is_bindable = False
+
+    def add(self, text, unsafe_pat):
+        refs = [match_obj.group(1) for match_obj in ref_pat.finditer(text or "")]
+        for ref in refs:
+            self.checks.setdefault(ref, set()).add(unsafe_pat)
+        return len(refs)
+
+    def add_content(self, text):
+        match_obj = ref_pat.search(text)
+        if match_obj and not is_inert_prefix(text[: match_obj.start()].lstrip()):
+            # eg: "{code}" might be a status code, and "delay={ms}ms" a delay
+            self.is_bindable = False
+        return self.add(text, unsafe_content_pat)
+
+    def bind(self, resolve_reference):
+        # returns a render function for the rules, or None if the text must be resolved before parsing
+        if not self.is_bindable:
+            return None
+
+        values = {}
+        for ref, unsafe_pats in self.checks.items():
+            value = str(resolve_reference(ref))
+            for unsafe_pat in unsafe_pats:
+                if unsafe_pat.search(value):
+                    return None
+            values[ref] = value
+
+        return Renderer(values)
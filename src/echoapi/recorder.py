@@ -0,0 +1,149 @@
+from .settings import record_backups, record_file, record_max_bytes, record_queue_size
+
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import urllib.parse
+
+
+class Recorder:
+    """Appends requests to a rotating json lines file from a background thread, so requests only queue them"""
+
+    batch_size = 256  # most requests written with one write() call
+
+    # request headers that are set by whoever replays the request, rather than copied from the capture
+    skipped_headers = {"HTTP_HOST", "HTTP_CONNECTION", "HTTP_TRANSFER_ENCODING"}
+
+    def __init__(self, path, max_bytes, backups, queue_size):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue = queue.Queue(queue_size)
+        self.recorded = 0
+        self.dropped = 0  # requests not recorded because the queue was full
+        self.lock = threading.Lock()  # for the counts, which request threads and the writer thread update
+        self.fh = None
+        self.thread = None
+
+    def start(self):
+        # eg: "capture-{pid}.jsonl", for a file per worker process
+        self.path = self.path.replace("{pid}", str(os.getpid()))
+        self.thread = threading.Thread(target=self.run, name="echoapi-recorder", daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    @staticmethod
+    def entry(request, rule_ids, status_code):
+        # the parts of the request as they are in the WSGI environ, which are decoded by the background thread
+        environ = request.environ
+        return (
+            environ["REQUEST_METHOD"],
+            environ.get("PATH_INFO", ""),
+            environ.get("QUERY_STRING", ""),
+            [(key, value) for key, value in environ.items() if key.startswith("HTTP_") or key == "CONTENT_TYPE"],
+            request.get_data(),
+            rule_ids,
+            status_code,
+        )
+
+    def line(self, entry):
+        # eg: {"method": "GET", "path": "/pets/id:7", "params": {...}, "headers": {...}, "body": "", ...}
+        method, path, query_string, environ_headers, body, rule_ids, status_code = entry
+        headers = {}
+        for key, value in environ_headers:
+            if key not in self.skipped_headers:
+                name = key[5:] if key.startswith("HTTP_") else key
+                headers[name.replace("_", "-").title()] = value
+        # WSGI strings are bytes decoded as latin-1
+        path = path.encode("latin-1").decode(errors="replace")
+        query_string = query_string.encode("latin-1").decode(errors="replace")
+        params = dict(urllib.parse.parse_qsl(query_string, keep_blank_values=True))
+        return json.dumps(
+            {
+                "method": method,
+                "path": path,
+                "params": params,
+                "headers": headers,
+                "body": body.decode(errors="replace"),
+                "rule_ids": rule_ids,
+                "status": status_code,
+            }
+        )
+
+    def record(self, entry):
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+    def run(self):
+        # until stop() queues None, after the requests queued before it
+        is_stopping = False
+        while not is_stopping:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            is_stopping = batch[-1] is None
+            entries = batch[:-1] if is_stopping else batch
+            try:
+                if entries:
+                    self.write(entries)
+            except Exception as e:
+                print(f"RECORDER: failed to write {len(entries)} requests, {type(e).__name__}: {e}", file=sys.stderr)
+                self.close()
+            for _ in batch:
+                self.queue.task_done()
+        self.close()
+
+    def write(self, batch):
+        if self.fh is None:
+            self.fh = open(self.path, "a")
+        self.fh.write("".join(self.line(entry) + "\n" for entry in batch))
+        self.fh.flush()
+        with self.lock:
+            self.recorded += len(batch)
+        if self.fh.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        # eg: requests.jsonl.1 to requests.jsonl.2, then requests.jsonl to requests.jsonl.1
+        self.close()
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{n}"):
+                os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+    def close(self):
+        if self.fh is not None:
+            self.fh.close()
+            self.fh = None
+
+    def stop(self, timeout=5):
+        # registered with atexit, so the requests still queued are written before the process exits
+        if self.thread is None or not self.thread.is_alive():
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return  # the writer thread is stuck
+        self.thread.join(timeout)
+
+    def flush(self):
+        # waits until every queued request has been written
+        self.queue.join()
+
+    def stats(self):
+        return {"file": self.path, "recorded": self.recorded, "dropped": self.dropped, "queued": self.queue.qsize()}
+
+
+recorder = Recorder(record_file, record_max_bytes, record_backups, record_queue_size)
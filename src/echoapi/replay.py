@@ -0,0 +1,261 @@
+"""
+Replays captured requests against an echo server, and reports throughput and latency, eg:
+
+    PYTHONPATH=src python -m echoapi.replay capture.jsonl --concurrency 20 --rate 500 --count 10000
+
+Each line of the capture is a json object with the path, and optionally the method, params, headers, and
+either a body (text) or json (any json value), eg:
+
+    {"method": "POST", "path": "/pets/id:7", "params": {"_echo_response": "201 text:ok"}, "json": {"a": 1}}
+
+Requests are sent by a fixed number of workers, each with its own keep-alive connection, in the order of the
+capture, which is repeated to make up the count.  With a rate, requests are started on a schedule rather than
+as soon as a worker is free.  Latency is split into the delay the rules asked for and the rest, which is the
+server overhead, using the delay reported in the Server-Timing header when the server has ECHO_API_TIMING=1.
+"""
+
+from urllib.parse import quote, urlencode, urlsplit
+
+import argparse
+import asyncio
+import json
+import math
+import re
+import sys
+import time
+
+
+delay_pat = re.compile(r"(?:^|,)\s*delay;dur=([\d.]+)")
+
+
+class CaptureError(ValueError):
+    pass
+
+
+def load_capture(path):
+    # the requests in a capture, skipping lines that are not requests, eg: blank lines
+    captured = []
+    with open(path) as fh:
+        for line in fh:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if isinstance(entry, dict) and isinstance(entry.get("path"), str):
+                captured.append(request_of(entry))
+    if not captured:
+        raise CaptureError(f"no requests in {path}, each line needs at least a path")
+    return captured
+
+
+def request_of(entry):
+    # (method, target, headers, body) of a captured request
+    method = entry.get("method", "GET").upper()
+    # the path is captured decoded, eg: "/a b/id:1", so it is quoted again, leaving the characters it may have
+    target = quote("/" + entry["path"].lstrip("/"), safe="/:@!$&'()*+,;=")
+    params = entry.get("params")
+    if params:
+        target += "?" + urlencode(params, doseq=True)
+    headers = {name.title(): str(value) for name, value in (entry.get("headers") or {}).items()}
+    if "json" in entry:
+        body = json.dumps(entry["json"]).encode()
+        headers.setdefault("Content-Type", "application/json")
+    else:
+        body = (entry.get("body") or "").encode()
+    return method, target, headers, body
+
+
+class Connection:
+    """A keep-alive HTTP/1.1 connection, opened when first used and again if the server closes it"""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, target, headers, body):
+        # returns the status code, headers (with lower case names), and body of the response
+        if self.writer is not None:
+            try:
+                return await asyncio.wait_for(self.exchange(method, target, headers, body), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self.close()  # closed by the server while idle, so try again once on a new connection
+
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        return await asyncio.wait_for(self.exchange(method, target, headers, body), self.timeout)
+
+    async def exchange(self, method, target, headers, body):
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {self.host}:{self.port}", f"Content-Length: {len(body)}"]
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readuntil(b"\r\n")
+        status = int(status_line.split(b" ", 2)[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        content = await self.read_body(method, status, response_headers)
+        if response_headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, response_headers, content
+
+    async def read_body(self, method, status, headers):
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            return b""
+        if "content-length" in headers:
+            return await self.reader.readexactly(int(headers["content-length"]))
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                if size == 0:
+                    while await self.reader.readuntil(b"\r\n") != b"\r\n":
+                        pass  # trailers
+                    return b"".join(chunks)
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readexactly(2)
+        headers["connection"] = "close"  # the body ends when the connection is closed
+        return await self.reader.read()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class Result:
+    __slots__ = ("status", "seconds", "delay")
+
+    def __init__(self, status, seconds, delay):
+        self.status = status  # None for a request that failed
+        self.seconds = seconds
+        self.delay = delay  # seconds, from the Server-Timing header, else None
+
+
+def server_timing_delay(headers):
+    # the delay the rules asked for, in seconds, eg: 0.1 for "delay;dur=100.000, total;dur=100.561"
+    server_timing = headers.get("server-timing")
+    if server_timing is None:
+        return None  # the server is not reporting its timing
+    m = delay_pat.search(server_timing)
+    return float(m.group(1)) / 1000 if m else 0.0
+
+
+async def replay(url, captured, count, concurrency, rate=0, timeout=30):
+    # sends count requests, cycling through the captured ones, and returns the Results and the seconds taken
+    parts = urlsplit(url)
+    host, port = parts.hostname or "127.0.0.1", parts.port or 80
+    prefix = parts.path.rstrip("/")
+    results = []
+    next_index = 0
+    start = time.perf_counter()
+
+    async def worker():
+        nonlocal next_index
+        connection = Connection(host, port, timeout)
+        try:
+            while next_index < count:
+                index = next_index
+                next_index += 1
+                if rate:
+                    await asyncio.sleep(max(0.0, start + index / rate - time.perf_counter()))
+                method, target, headers, body = captured[index % len(captured)]
+                sent = time.perf_counter()
+                try:
+                    status, response_headers, _ = await connection.request(method, prefix + target, headers, body)
+                except (OSError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    connection.close()
+                    results.append(Result(None, time.perf_counter() - sent, None))
+                    continue
+                results.append(Result(status, time.perf_counter() - sent, server_timing_delay(response_headers)))
+        finally:
+            connection.close()
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, count))))
+    return results, time.perf_counter() - start
+
+
+def percentile(sorted_values, fraction):
+    # nearest rank, eg: percentile(values, 0.99) for p99
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(results, seconds):
+    statuses = {}
+    for result in results:
+        key = "error" if result.status is None else str(result.status)
+        statuses[key] = statuses.get(key, 0) + 1
+
+    completed = [result for result in results if result.status is not None]
+    timed = [result for result in completed if result.delay is not None]
+
+    def latencies(values):
+        values = sorted(values)
+        summary = {f"p{int(f * 100)}": round(percentile(values, f) * 1000, 3) for f in (0.5, 0.95, 0.99)}
+        summary["max"] = round(values[-1] * 1000, 3) if values else 0.0
+        return summary
+
+    summary = {
+        "requests": len(results),
+        "statuses": dict(sorted(statuses.items())),
+        "seconds": round(seconds, 3),
+        "requests_per_sec": round(len(completed) / seconds, 1) if seconds else 0.0,
+        "latency_ms": latencies(result.seconds for result in completed),
+    }
+    if timed:
+        # the delay the rules asked for, and the rest of the time, for the requests that reported their delay
+        summary["delay_ms"] = latencies(result.delay for result in timed)
+        summary["overhead_ms"] = latencies(max(0.0, result.seconds - result.delay) for result in timed)
+    return summary
+
+
+def report(summary):
+    lines = [
+        f"requests:   {summary['requests']} in {summary['seconds']}s, {summary['requests_per_sec']} per second",
+        "statuses:   " + ", ".join(f"{status}: {n}" for status, n in summary["statuses"].items()),
+    ]
+    for name, label in (("latency_ms", "latency"), ("delay_ms", "delay"), ("overhead_ms", "overhead")):
+        if name in summary:
+            lines.append(f"{label + ':':<11} " + ", ".join(f"{k} {v:.1f}ms" for k, v in summary[name].items()))
+    if "delay_ms" not in summary:
+        lines.append("(set ECHO_API_TIMING=1 on the server to separate the delay from the server overhead)")
+    return "\n".join(lines)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(prog="python -m echoapi.replay", description="Replay captured requests")
+    parser.add_argument("capture", help="jsonl file of requests")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="echo server, default http://127.0.0.1:5000")
+    parser.add_argument("--concurrency", type=int, default=10, help="number of connections, default 10")
+    parser.add_argument("--rate", type=float, default=0, help="requests started per second, default 0 for no limit")
+    parser.add_argument("--count", type=int, help="number of requests, default the number in the capture")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for a response, default 30")
+    parser.add_argument("--json", action="store_true", help="print the summary as json")
+    options = parser.parse_args(args)
+
+    try:
+        captured = load_capture(options.capture)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    count = options.count or len(captured)
+    results, seconds = asyncio.run(
+        replay(options.url, captured, count, options.concurrency, options.rate, options.timeout)
+    )
+    summary = summarize(results, seconds)
+    print(json.dumps(summary, indent=2) if options.json else report(summary))
+    return 0 if "error" not in summary["statuses"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,106 @@
+from .json_path import json_text, missing
+from .json_stream import JsonExtractor
+from .settings import json_stream_min_bytes
+from .timing import no_timer
+
+from flask import request
+
+import re
+
+
+class RequestFacets:
+    """Parts of the current request that rules select on or refer to, each decoded on first use"""
+
+    param_pat = re.compile(r"^(\w+):(.*)$")
+
+    def __init__(self, path="", timer=no_timer):
+        self.request_path = path  # path matched by the route, which may contain params, eg: "pets/id:7"
+        self.timer = timer  # the time spent decoding is charged to the "decode" phase
+        self._headers = None
+        self._params = None
+        self._json = None
+        self._body = None
+        self.json_texts = {}  # json path -> text of its value
+        self.json_paths = set()  # json paths the rules may use, extracted together from a large body
+        self.json_values = {}  # json path -> value extracted from a large body, or missing
+        self._is_json_streamed = None
+
+    @classmethod
+    def of(cls, headers, params, json):
+        # facets with the given values, rather than values from the current request
+        facets = cls()
+        facets._headers, facets._params, facets._json = headers, params, json
+        return facets
+
+    @property
+    def headers(self):
+        if self._headers is None:
+            with self.timer.phase("decode"):
+                self._headers = {header: request.headers.get(header) for header in request.headers.keys()}
+        return self._headers
+
+    @property
+    def params(self):
+        if self._params is None:
+            with self.timer.phase("decode"):
+                path_params = {}
+                for part in self.request_path.split("/"):
+                    m = self.param_pat.search(part)
+                    if m:
+                        path_params[m.group(1)] = m.group(2)
+                self._params = {**path_params, **request.args.to_dict()}
+        return self._params
+
+    @property
+    def json(self):
+        if self._json is None:
+            with self.timer.phase("decode"):
+                try:
+                    json = request.get_json()
+                except Exception:
+                    json = {}
+                self._json = {} if json is None else json
+        return self._json
+
+    @property
+    def is_json_streamed(self):
+        # large json bodies have fields extracted as needed, unless the whole body has been decoded anyway
+        if self._is_json_streamed is None:
+            size = request.content_length or 0
+            self._is_json_streamed = 0 < json_stream_min_bytes <= size and request.is_json
+        return self._is_json_streamed and self._json is None
+
+    def expect_json_paths(self, paths):
+        self.json_paths.update(paths)
+
+    def json_text(self, path):
+        text = self.json_texts.get(path)
+        if text is None:
+            value = self.streamed_json_value(path) if self.is_json_streamed else missing
+            text = json_text(self.json, path) if value is missing else format(value)
+            self.json_texts[path] = text
+        return text
+
+    def streamed_json_value(self, path):
+        if path not in self.json_values:
+            paths = (self.json_paths | {path}) - self.json_values.keys()
+            with self.timer.phase("decode"):
+                try:
+                    values = JsonExtractor(paths).extract(self.body)
+                except ValueError:
+                    # invalid json, or not utf-8, which is left to decoding the whole body
+                    values = {}
+            for extracted_path in paths:
+                self.json_values[extracted_path] = values.get(extracted_path, missing)
+        return self.json_values[path]
+
+    @property
+    def body(self):
+        if self._body is None:
+            with self.timer.phase("decode"):
+                self._body = request.get_data().decode()
+        return self._body
+
+    @property
+    def path(self):
+        return request.path
@@ -0,0 +1,156 @@
+from .encoded_body import EncodedBody
+from .settings import response_files_check_interval, response_files_max_bytes, responses_dir, static_file_min_bytes
+
+from collections import OrderedDict
+
+import os
+import threading
+import time
+
+
+class ResponseFile:
+    """Content of a response file, as text for .echo files and encoded for files returned verbatim"""
+
+    __slots__ = ("path", "text", "data", "mtime", "size", "checked")
+
+    def __init__(self, path, content, mtime, size):
+        self.path = path
+        self.mtime = mtime  # st_mtime_ns when loaded
+        self.size = size  # st_size when loaded
+        self.checked = time.monotonic()  # when mtime and size were last checked
+        if path.endswith(".echo"):
+            self.text = content
+            self.data = None
+        else:
+            # the bytes of the file as they are on disk, eg: with any CRLF line endings, or not text at all
+            self.text = None
+            self.data = EncodedBody(content, mtime / 1e9)
+
+    def content(self):
+        return self.text if self.data is None else self.data.decode()
+
+    def num_bytes(self):
+        return len(self.text) if self.data is None else len(self.data)
+
+
+class StaticFile:
+    """A large response file, returned verbatim by streaming it from disk"""
+
+    __slots__ = ("path", "etag", "last_modified")
+
+    def __init__(self, path, mtime=None, size=None):
+        self.path = path
+        # from the mtime and size, rather than hashing a file that is too large to keep in memory
+        self.etag = None if mtime is None else f"{mtime:x}-{size:x}"
+        self.last_modified = None if mtime is None else mtime / 1e9
+
+    def open(self):
+        return open(self.path, "rb")
+
+    def content(self):
+        # like ResponseFile.content(), the bytes of the file decoded, without translating line endings
+        with open(self.path, "rb") as fh:
+            return fh.read().decode()
+
+
+class ResponseFileStore:
+    """Response files kept in memory, reloaded when modified on disk"""
+
+    def __init__(self, root, max_bytes, check_interval, static_min_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.static_min_bytes = static_min_bytes
+        self.check_interval = check_interval / 1000  # seconds
+        self.files = OrderedDict()  # LRU of file -> ResponseFile
+        self.num_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+
+    def load(self, file):
+        with self.lock:
+            entry = self.files.get(file)
+            if entry is not None:
+                self.files.move_to_end(file)
+
+        if entry is not None and self.is_current(entry):
+            self.hits += 1
+            return entry
+
+        path = os.path.join(self.root, file)
+        if not file.endswith(".echo"):
+            stat = os.stat(path)
+            if stat.st_size >= self.static_min_bytes:
+                self.drop(file)
+                return StaticFile(path, stat.st_mtime_ns, stat.st_size)
+
+        # only .echo files are decoded, other files are returned byte for byte
+        with open(path, "r" if file.endswith(".echo") else "rb") as fh:
+            stat = os.fstat(fh.fileno())
+            content = fh.read()
+        new_entry = ResponseFile(file, content, stat.st_mtime_ns, stat.st_size)
+
+        if entry is None:
+            self.misses += 1
+        else:
+            self.reloads += 1
+        self.add(file, new_entry)
+        return new_entry
+
+    def is_current(self, entry):
+        now = time.monotonic()
+        if now - entry.checked < self.check_interval:
+            return True
+
+        try:
+            stat = os.stat(os.path.join(self.root, entry.path))
+        except OSError:
+            return False
+        if stat.st_mtime_ns != entry.mtime or stat.st_size != entry.size:
+            return False
+
+        entry.checked = now
+        return True
+
+    def add(self, file, entry):
+        self.drop(file)
+        with self.lock:
+            # files too big to keep are loaded on every use
+            if entry.num_bytes() > self.max_bytes:
+                return
+
+            self.files[file] = entry
+            self.num_bytes += entry.num_bytes()
+            while self.num_bytes > self.max_bytes:
+                _, evicted = self.files.popitem(last=False)
+                self.num_bytes -= evicted.num_bytes()
+                self.evictions += 1
+
+    def drop(self, file):
+        with self.lock:
+            entry = self.files.pop(file, None)
+            if entry is not None:
+                self.num_bytes -= entry.num_bytes()
+
+    def clear(self):
+        with self.lock:
+            self.files.clear()
+            self.num_bytes = 0
+
+    def stats(self):
+        return {
+            "files": len(self.files),
+            "bytes": self.num_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reloads": self.reloads,
+            "evictions": self.evictions,
+        }
+
+
+response_files = ResponseFileStore(
+    responses_dir, response_files_max_bytes, response_files_check_interval, static_file_min_bytes
+)
@@ -5,6 +5,23 @@ import re
 
 
 class ResponseParser:
+
+    # the first element of a line determines which of the patterns below could match it
+    head_pat = re.compile(
+        r"\s*(?:(?P<comment>#)|(?P<status>\d)|(?P<dash>-)|(?P<delay>delay)|(?P<after>after)"
+        r"|(?P<selector>HEADER|PATH|PARAM|JSON|BODY)|(?P<location>text|file))?"
+    )
+
+    leading_marker_pat = re.compile(r"[|@>]\s*(.*)", re.DOTALL)
+    marker_pat = re.compile(r"[|@>]\s*((HEADER|PATH|PARAM|JSON|BODY|text|file):)")
+    blank_pat = re.compile(r"\s*$")
+
+    separator_pat = re.compile(r"\s*-{2,}(?!\[\s*\d+\s*\]--)\s*(.*)", re.DOTALL)
+    status_code_pat = re.compile(r"\s*(\d{3})\b\s*(.*)", re.DOTALL)
+    delay_pat = re.compile(r"\s*delay\s*=(\d+)ms\b\s*(.*)", re.DOTALL)
+    after_pat = re.compile(r"\s*after\s*=(\d+)ms\b\s*(.*)", re.DOTALL)
+    sequence_marker_pat = re.compile(r"\s*--\[\s*(\d*)\s*\]--\s*(.*)", re.DOTALL)
+
     def __init__(self, rule_source, status_code, delay, after):
         """
         :param rule_source:
@@ -21,17 +38,17 @@ class ResponseParser:
         self.status_code = status_code  # will be updated if rule-specific value is parsed
         self.delay = delay  # will be updated if rule-specific value is parsed
         self.after = after  # will be updated if rule-specific value is parsed
-        self.lines = None  # used by parse() to support parsing elements at beginning of line
+        self.remainder = None  # rest of the line, after parse_line() parses an element at the beginning of it
         self.is_sequenced = False  # used by parse() to know if text is part of sequenced content
         self.rules = []  # returned by parse(), this is the primary product of parsing
         self.global_scope = True
 
     def parse(self, text):
-        self.lines = self.parse_response_into_lines(text)
-
-        while self.lines:
-            line = self.lines.pop(0)
-            self.parse_line(line)
+        for line in self.parse_response_into_lines(text):
+            while line:
+                self.remainder = None
+                self.parse_line(line)
+                line = self.remainder
 
         is_from_file = False if self.rule_source == "" else True
         rulesAdjuster = RulesAdjuster(is_from_file, self.rules)
@@ -42,48 +59,43 @@ class ResponseParser:
     def parse_response_into_lines(self, text):
         # remove one of [|@>] from beginning of text to avoid creating an extra blank line
         # by the sub() command below
-        m = re.match(r"[|@>]\s*(.*)", text, re.DOTALL)
+        m = self.leading_marker_pat.match(text)
         if m:
             text = m.group(1)
 
         # replace one of [|@>] with newline if it precedes a selector type or location specifier
-        multiline = re.sub(r"[|@>]\s*((HEADER|PATH|PARAM|JSON|BODY|text|file):)", r"\n\1", text)
+        multiline = self.marker_pat.sub(r"\n\1", text)
 
         return multiline.splitlines(keepends=True)
 
     def parse_line(self, line):
+        m = self.head_pat.match(line)
+        head = m.lastgroup
+
         # comments are completely ignored, period
-        if self.is_comment(line):
+        if head == "comment":
             pass
 
         # a match here implies there is no sequenced content yet
-        elif self.global_scope and self.begins_with_status_code(line):
+        elif self.global_scope and head == "status" and self.begins_with_status_code(line):
             pass
-        elif self.global_scope and self.begins_with_delay(line):
+        elif self.global_scope and head == "delay" and self.begins_with_delay(line):
             pass
-        elif self.global_scope and self.begins_with_after(line):
+        elif self.global_scope and head == "after" and self.begins_with_after(line):
             pass
-        elif self.begins_with_separator(line):
+        elif head == "dash" and self.begins_with_separator(line):
             self.global_scope = False
 
         # a match here ends parsing of sequenced content and begins a new rule
-        elif self.is_matching_header_rule(line):
-            pass
-        elif self.is_matching_path_rule(line):
-            pass
-        elif self.is_matching_param_rule(line):
-            pass
-        elif self.is_matching_json_rule(line):
-            pass
-        elif self.is_matching_body_rule(line):
+        elif head == "selector" and self.is_matching_selector_rule(m.group(head), line):
             pass
 
         # a match here begins sequenced content and creates a rule if there are none yet
-        elif self.begins_with_sequence_marker(line):
+        elif head == "dash" and self.begins_with_sequence_marker(line):
             pass
 
         # a match here creates a new rule or (if part of sequenced content) starts a new element in the current sequence
-        elif self.is_matching_rule_with_explicit_location(line):
+        elif head in ("status", "delay", "after", "location") and self.is_matching_rule_with_explicit_location(line):
             pass
 
         # a match here adds to an existing text rule, whether part of sequenced content or not
@@ -93,7 +105,7 @@ class ResponseParser:
             self.rules[-1].values[-1].append(line)
 
         # blank lines are ignored before any rules or after a file rule
-        elif self.is_blank(line):
+        elif head is None and self.is_blank(line):
             pass
 
         # a match here creates a new rule or (if part of sequenced content) starts a new element in the current sequence
@@ -138,7 +150,7 @@ class ResponseParser:
         self.rules.append(rule)
 
     def add_if_match(self, line, pattern, groups, reset_sequence=True):
-        m = re.match(pattern, line, re.DOTALL)
+        m = pattern.match(line)
         if m:
             if reset_sequence:
                 self.is_sequenced = False
@@ -156,50 +168,47 @@ class ResponseParser:
             return True
         return False
 
-    def is_comment(self, line):
-        return re.match(r"\s*#", line)
-
     def is_blank(self, line):
-        return re.match(r"\s*$", line)
+        return self.blank_pat.match(line)
 
     def begins_with_separator(self, line):
         # match 2 or more hyphens, not followed by "[ N ]--" (since "--[ N ]--" is how we start sequenced content
-        m = re.match(r"\s*-{2,}(?!\[\s*\d+\s*\]--)\s*(.*)", line, re.DOTALL)
+        m = self.separator_pat.match(line)
         if m:
             if len(m.group(1)) > 0:
-                self.lines.insert(0, m.group(1))
+                self.remainder = m.group(1)
             return True
         return False
 
     def begins_with_status_code(self, line):
-        m = re.match(r"\s*(\d{3})\b\s*(.*)", line, re.DOTALL)
+        m = self.status_code_pat.match(line)
         if m:
             self.status_code = int(m.group(1))
             if len(m.group(2)) > 0:
-                self.lines.insert(0, m.group(2))
+                self.remainder = m.group(2)
             return True
         return False
 
     def begins_with_delay(self, line):
-        m = re.match(r"\s*delay\s*=(\d+)ms\b\s*(.*)", line, re.DOTALL)
+        m = self.delay_pat.match(line)
         if m:
             self.delay = int(m.group(1))
             if len(m.group(2)) > 0:
-                self.lines.insert(0, m.group(2))
+                self.remainder = m.group(2)
             return True
         return False
 
     def begins_with_after(self, line):
-        m = re.match(r"\s*after\s*=(\d+)ms\b\s*(.*)", line, re.DOTALL)
+        m = self.after_pat.match(line)
         if m:
             self.after = int(m.group(1))
             if len(m.group(2)) > 0:
-                self.lines.insert(0, m.group(2))
+                self.remainder = m.group(2)
             return True
         return False
 
     def begins_with_sequence_marker(self, line):
-        m = re.match(r"\s*--\[\s*(\d*)\s*\]--\s*(.*)", line, re.DOTALL)
+        m = self.sequence_marker_pat.match(line)
         if not m:
             return False
 
@@ -216,47 +225,57 @@ class ResponseParser:
             self.is_sequenced = True
 
         if len(m.group(2)) > 0:
-            self.lines.insert(0, m.group(2))
+            self.remainder = m.group(2)
 
         return True
 
     # fmt: off
 
-    def is_matching_header_rule(self, line):
-        return self.add_if_match(line,
-            r"\s*(HEADER):\s*(.+?)\s*(!?/.*?/i?)\s*((\d{3})\b\s*)?(delay=(\d+)ms\s*)?(after=(\d+)ms\s*)?((text|file):)?\s*(.*)",
-            (    1,          2,      3,             5,                   7,                 9,           11,              12  ))
-
-    def is_matching_param_rule(self, line):
-        return self.add_if_match(line,
-            r"\s*(PARAM):\s*(.+?)\s*(!?/.*?/i?)\s*((\d{3})\b\s*)?(delay=(\d+)ms\s*)?(after=(\d+)ms\s*)?((text|file):)?\s*(.*)",
-            (    1,         2,      3,             5,                   7,                 9,           11,              12  ))
+    # patterns for the beginning of a rule, each with the groups passed to add_rule() as args
+
+    selector_rules = {
+        "HEADER": (
+            re.compile(r"\s*(HEADER):\s*(.+?)\s*(!?/.*?/i?)\s*((\d{3})\b\s*)?(delay=(\d+)ms\s*)?(after=(\d+)ms\s*)?((text|file):)?\s*(.*)", re.DOTALL),
+                       (    1,          2,      3,             5,                   7,                 9,           11,              12  ),
+        ),
+        "PARAM": (
+            re.compile(r"\s*(PARAM):\s*(.+?)\s*(!?/.*?/i?)\s*((\d{3})\b\s*)?(delay=(\d+)ms\s*)?(after=(\d+)ms\s*)?((text|file):)?\s*(.*)", re.DOTALL),
+                       (    1,         2,      3,             5,                   7,                 9,           11,              12  ),
+        ),
+        "JSON": (
+            re.compile(r"\s*(JSON):\s*(.+?)\s*(!?/.*?/i?)\s*((\d{3})\b\s*)?(delay=(\d+)ms\s*)?(after=(\d+)ms\s*)?((text|file):)?\s*(.*)", re.DOTALL),
+                       (    1,        2,      3,             5,                   7,                 9,           11,              12  ),
+        ),
+        "PATH": (
+            re.compile(r"\s*(PATH):\s*(!?/.*?/i?)\s*((\d{3})\b\s*)?(delay=(\d+)ms\s*)?(after=(\d+)ms\s*)?((text|file):)?\s*(.*)", re.DOTALL),
+                       (    1,     0, 2,             4,                   6,                 8,           10,              11  ),
+        ),
+        "BODY": (
+            re.compile(r"\s*(BODY):\s*(!?/.*?/i?)\s*((\d{3})\b\s*)?(delay=(\d+)ms\s*)?(after=(\d+)ms\s*)?((text|file):)?\s*(.*)", re.DOTALL),
+                       (    1,     0, 2,             4,                   6,                 8,           10,              11  ),
+        ),
+    }
+
+    explicit_location_rule = (
+        re.compile(r"\s*((\d{3})\b\s*)?(delay=(\d+)ms\s*)?(after=(\d+)ms\s*)?(text|file):\s*(.*)", re.DOTALL),
+                   (0,0,0,2,                  4,                 6,          7,             8   ),
+    )
+
+    implied_text_location_rule = (
+        re.compile(r"(\s*(\d{3})\b)?(\s*delay=(\d+)ms)?(\s*after=(\d+)ms)?(.*)", re.DOTALL),
+                   (0,0,0,2,                  4,                 6,    0, 7   ),
+    )
 
-    def is_matching_json_rule(self, line):
-        return self.add_if_match(line,
-            r"\s*(JSON):\s*(.+?)\s*(!?/.*?/i?)\s*((\d{3})\b\s*)?(delay=(\d+)ms\s*)?(after=(\d+)ms\s*)?((text|file):)?\s*(.*)",
-            (    1,        2,      3,             5,                   7,                 9,           11,              12  ))
-
-    def is_matching_path_rule(self, line):
-        return self.add_if_match(line,
-            r"\s*(PATH):\s*(!?/.*?/i?)\s*((\d{3})\b\s*)?(delay=(\d+)ms\s*)?(after=(\d+)ms\s*)?((text|file):)?\s*(.*)",
-            (    1,     0, 2,             4,                   6,                 8,           10,              11  ))
+    # fmt: on
 
-    def is_matching_body_rule(self, line):
-        return self.add_if_match(line,
-            r"\s*(BODY):\s*(!?/.*?/i?)\s*((\d{3})\b\s*)?(delay=(\d+)ms\s*)?(after=(\d+)ms\s*)?((text|file):)?\s*(.*)",
-            (    1,     0, 2,             4,                   6,                 8,           10,              11  ))
+    def is_matching_selector_rule(self, selector_type, line):
+        pattern, groups = self.selector_rules[selector_type]
+        return self.add_if_match(line, pattern, groups)
 
     def is_matching_rule_with_explicit_location(self, line):
-        return self.add_if_match(line,
-            r"\s*((\d{3})\b\s*)?(delay=(\d+)ms\s*)?(after=(\d+)ms\s*)?(text|file):\s*(.*)",
-            (0,0,0,2,                  4,                 6,          7,             8   ),
-            reset_sequence=False)
+        pattern, groups = self.explicit_location_rule
+        return self.add_if_match(line, pattern, groups, reset_sequence=False)
 
     def add_rule_with_implied_text_location(self, line):
-        return self.add_if_match(line,
-            r"(\s*(\d{3})\b)?(\s*delay=(\d+)ms)?(\s*after=(\d+)ms)?(.*)",
-            (0,0,0,2,                  4,                 6,    0, 7   ),
-            reset_sequence=False)
-
-    # fmt: on
+        pattern, groups = self.implied_text_location_rule
+        return self.add_if_match(line, pattern, groups, reset_sequence=False)
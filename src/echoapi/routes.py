@@ -1,23 +1,50 @@
-from .rules import (
-    reset as rules_reset,
-    rule_match_count,
-)
+from .rules import reset as rules_reset
 from .echo_server import EchoServer
+from .metrics import metrics
+from .recorder import recorder
+from .response_files import response_files
+from .rules_cache import rules_cache
+from .settings import record_file, timing, warm_up as is_warm_up_enabled
+from .state import state
+from .timing import timings
+from .warm_up import warm_up
 
-from flask import Flask
+from flask import Flask, jsonify, request, Response
 
 import time
 
 
 app = Flask(__name__)
 
+# set in the WSGI environ by a server that waits out the delay itself (see asgi.py), rather than blocking here
+DEFER_DELAY = "echoapi.defer_delay"
+DELAY = "echoapi.delay"
+
+if is_warm_up_enabled:
+    warm_up.start()
+
+if record_file:
+    recorder.start()
+
 
 @app.route("/<path:text>", methods=["GET", "POST", "PUT", "DELETE", "HEAD"])
 def all_routes(text):
+    start = time.perf_counter()
     server = EchoServer(text)
     delay, resp = server.response()
     if delay:
-        time.sleep(delay / 1000)
+        if request.environ.get(DEFER_DELAY):
+            request.environ[DELAY] = delay
+            server.timer.defer(delay / 1000)
+            start -= delay / 1000
+        else:
+            with server.timer.phase("delay"):
+                time.sleep(delay / 1000)
+    if timing:
+        server.record_timing(resp)
+    metrics.request_done(resp.status_code, time.perf_counter() - start)
+    if record_file:
+        recorder.record(recorder.entry(request, server.rule_ids, resp.status_code))
     return resp
 
 
@@ -33,9 +60,30 @@ def reset():
 
 
 @app.route("/_echo_list_rules", methods=["GET"])
-def list_rules():  # for debugging
-    keys = rule_match_count.keys()
-    for k in sorted(keys):
-        v = rule_match_count[k]
-        print(f"RULE: {v:5} {k}")
+def list_rules():  # for debugging, see _echo_metrics for monitoring
+    rule_match_count = state.match_counts()
+    lines = [f"RULE: {v:5} {k}\n" for k, v in sorted(rule_match_count.items())]
+    return Response(lines, mimetype="text/plain")
+
+
+@app.route("/_echo_metrics", methods=["GET"])
+def metrics_exposition():
+    return Response(metrics.exposition(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/_echo_stats", methods=["GET"])
+def stats():
+    return jsonify(
+        rules_cache=rules_cache.stats(),
+        response_files=response_files.stats(),
+        warm_up=warm_up.stats(),
+        timing=timings.stats(),
+        recorder=recorder.stats() if record_file else None,
+    )
+
+
+@app.route("/_echo_ready", methods=["GET"])
+def ready():  # for health checks, eg: while .echo files are loaded at startup
+    if not warm_up.is_ready():
+        return "warming up", 503
     return "ok"
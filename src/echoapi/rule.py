@@ -1,10 +1,29 @@
-from flask import request
+from .encoded_body import EncodedBody
+from .placeholders import ref_pat
 
+import functools
 import re
 import typing
 
 
+class RuleError(ValueError):
+    pass
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_pattern(pattern):
+    # parse the regular expression and flags from a pattern spec, eg: "dog" from "!/dog/i"
+    flags = re.IGNORECASE if pattern[-1] == "i" else 0
+    is_positive = pattern[0] != "!"
+    try:
+        regex = re.compile(pattern[pattern.index("/") + 1 : pattern.rindex("/")], flags)
+    except re.error as e:
+        raise RuleError(f"invalid pattern {pattern}: {e}") from None
+    return regex, is_positive
+
+
 class Rule(typing.NamedTuple):
+    """A rule as it is parsed, with lists that ResponseParser and RulesAdjuster add to"""
 
     rule_source: str  # "" if directly from _echo_response, or name of file otherwise
     after: int  # eg: 200, represents number of milliseconds after start/reset of echo server
@@ -17,15 +36,20 @@ class Rule(typing.NamedTuple):
     headers: list  # [ {},... ]
     values: list  # [ [...],... ]
 
-    def unique_id(self, request_path):
-        after = str(self.after or 0)
-        selector_type = "" if self.selector_type is None else self.selector_type
-        selector_target = "" if self.selector_target is None else self.selector_target
-        pattern = "" if self.pattern is None else self.pattern
-        return ":".join((request_path, self.rule_source, selector_type, selector_target, pattern, after))
-
-    def rule4location(self, location, headers, values):
-        return Rule(
+    def freeze(self, is_template=False):
+        # an immutable copy of a parsed rule, safe to share between requests
+        regex, is_positive = None, True
+        if self.pattern is not None and not (is_template and ref_pat.search(self.pattern)):
+            try:
+                regex, is_positive = compile_pattern(self.pattern)
+            except RuleError as e:
+                raise RuleError(f"{e} in {self.rule_source or '_echo_response'}") from None
+
+        sequence = tuple(
+            sequence_entry(locations, values, headers, is_template)
+            for locations, values, headers in zip(self.location, self.values, self.headers)
+        )
+        return CompiledRule(
             self.rule_source,
             self.after,
             self.selector_type,
@@ -33,85 +57,151 @@ class Rule(typing.NamedTuple):
             self.pattern,
             self.status_code,
             self.delay,
-            location,
-            headers,
-            values,
+            sequence,
+            regex,
+            is_positive,
         )
 
-    def at_offset(self, offset):
-        locations = self.location[offset]
-        values = self.values[offset]
 
-        rules = []
-        while locations and locations[0] == "file":
-            headers = self.headers[offset]
-            rule = self.rule4location(locations.pop(0), headers, values.pop(0))
-            rules.append(rule)
+def sequence_contents(locations, values):
+    # files at the start of the content are each tried in turn, the rest of the content is a single text, and
+    # a file without a name, or a location without any value, is skipped rather than failing every request
+    contents = []
+    index = 0
+    while index < len(locations) and index < len(values) and locations[index] == "file":
+        contents.append(("file", values[index]))
+        index += 1
+
+    if index < len(locations) and index < len(values):
+        contents.append((locations[index], tuple(values[index:])))
+
+    return tuple(contents)
+
+
+def sequence_entry(locations, values, headers, is_template):
+    headers = tuple(headers.items())
+    contents = sequence_contents(locations, values)
+
+    # text without parameter references to substitute is served as is, so it is encoded once, here
+    location, value = contents[-1] if contents else ("file", None)
+    body = None
+    if location != "file" and not (is_template and ref_pat.search("".join(value))):
+        body = EncodedBody("".join(value).encode())
+    is_static = not (is_template and any(ref_pat.search(name + value) for name, value in headers))
+
+    return SequenceEntry(headers, contents, body, is_static)
+
+
+class SequenceEntry(typing.NamedTuple):
+
+    headers: tuple  # ((name, value),...)
+    contents: tuple  # (("file", file name),... ("text", (line,...)))
+    body: EncodedBody = None  # the text content encoded, unless it has parameter references
+    is_static: bool = True  # false if the headers have parameter references
+
+
+class CompiledRule:
+    """A frozen rule, with the content for each step of a sequence"""
+
+    __slots__ = (
+        "rule_source",
+        "after",
+        "selector_type",
+        "selector_target",
+        "pattern",
+        "status_code",
+        "delay",
+        "sequence",  # SequenceEntry for each sequenced content, or just one
+        "regex",  # compiled from pattern
+        "is_positive",  # false if pattern begins with !, to negate the match
+        "id_suffix",  # unique_id() without the request path
+    )
+
+    def __init__(
+        self,
+        rule_source,
+        after,
+        selector_type,
+        selector_target,
+        pattern,
+        status_code,
+        delay,
+        sequence,
+        regex,
+        is_positive,
+    ):
+        values = (rule_source, after, selector_type, selector_target, pattern, status_code, delay, sequence, regex)
+        for name, value in zip(self.__slots__, values + (is_positive,)):
+            object.__setattr__(self, name, value)
+
+        parts = (rule_source, selector_type or "", selector_target or "", pattern or "", str(after or 0))
+        object.__setattr__(self, "id_suffix", ":" + ":".join(parts))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        return CompiledRule, tuple(getattr(self, name) for name in self.__slots__[:-1])
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__[:-1])
+        return f"{type(self).__name__}({fields})"
+
+    def _replace(self, **changes):
+        return CompiledRule(*(changes.get(name, getattr(self, name)) for name in self.__slots__[:-1]))
+
+    def unique_id(self, request_path):
+        return request_path + self.id_suffix
+
+    def bind_selector(self, render):
+        # substitute request values for any placeholders in the selection criteria
+        selector_target = render(self.selector_target)
+        pattern = render(self.pattern)
+        if selector_target is self.selector_target and pattern is self.pattern:
+            return self
+        if pattern is self.pattern:
+            return self._replace(selector_target=selector_target)
 
-        if values:
-            headers = self.headers[offset]
-            rule = self.rule4location(locations.pop(0), headers, values)
-            rules.append(rule)
+        regex, is_positive = compile_pattern(pattern)
+        return self._replace(selector_target=selector_target, pattern=pattern, regex=regex, is_positive=is_positive)
 
-        return rules
+    def at_offset(self, offset):
+        return self.sequence[offset]
 
-    def _text(self, headers, params, json):
+    def _text(self, facets):
         value = None
 
         if self.selector_type == "HEADER":
             header_name = self.selector_target
-            value = headers.get(header_name, "")
+            value = facets.headers.get(header_name, "")
 
         elif self.selector_type == "PATH":
-            value = request.path
+            value = facets.path
 
         elif self.selector_type == "PARAM":
             param_name = self.selector_target
-            value = params.get(param_name, "")
+            value = facets.params.get(param_name, "")
 
         elif self.selector_type == "JSON":
-            json_path = self.selector_target
-            fmt = "{json." + json_path + "}"
-            value = fmt.format(json=json)
+            value = facets.json_text(self.selector_target)
 
         elif self.selector_type == "BODY":
-            body = request.get_data().decode()
-            value = body
+            value = facets.body
 
         return value
 
     def _matches(self, text):
-        # set case-sensitive flag
-        flags = 0
-        if self.pattern[-1] == "i":
-            flags = re.IGNORECASE
-
-        # determine match polarity
-        is_positive = True
-        if self.pattern[0] == "!":
-            is_positive = False
+        text_match = self.regex.search(text)
+        return (text_match is not None) == self.is_positive
 
-        # parse pattern text from pattern spec, eg: parse "dog" from "!/dog/i"
-        pattern = re.sub(r".*/(.*)/.*", r"\1", self.pattern)
-
-        got_match = False
-        text_match = re.search(pattern, text, flags)
-        if is_positive and text_match:
-            got_match = True
-        elif not is_positive and not text_match:
-            got_match = True
-
-        return got_match
-
-    def apply(self, headers, params, json, millis_since_reset):
+    def apply(self, facets, millis_since_reset):
         if self.selector_type is None:
             value = True
         else:
-            text = self._text(headers, params, json)
+            text = self._text(facets)
             value = self._matches(text)
 
         if millis_since_reset <= int(self.after or 0):
             value = False
 
         return value
-
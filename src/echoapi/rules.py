@@ -1,48 +1,79 @@
+from .dispatch_index import DispatchIndex
+from .metrics import metrics
+from .placeholders import no_render, Placeholders, ref_pat
 from .response_parser import ResponseParser
+from .rules_cache import rules_cache
+from .state import state
 
 import time
-
-
-last_reset_time_in_millis = 0
-rule_match_count = {}
+import typing
 
 
 def reset():
-    global last_reset_time_in_millis
-    last_reset_time_in_millis = current_time_in_millis()
-    rule_match_count.clear()
+    state.reset(current_time_in_millis())
 
 
 def current_time_in_millis():
     return int(round(time.time() * 1000))
 
 
-class Rules:
+class CompiledRules(typing.NamedTuple):
+
+    status_code: int  # default status code after parsing any global value
+    delay: int  # default delay after parsing any global value
+    rules: tuple  # frozen Rule instances, in order of evaluation
+    placeholders: Placeholders = None  # parameter references still in the rules, if parsed as a template
+    index: DispatchIndex = None  # finds the rules that might match a request
+    json_paths: frozenset = frozenset()  # json paths the rules select on or refer to, eg: "pet.dog.name"
+
 
-    def __init__(self, request_path, rule_source, default_status_code, default_delay, default_after, text):
+def parse_rules(rule_source, default_status_code, default_delay, default_after, text, is_template):
+    response_parser = ResponseParser(rule_source, default_status_code, default_delay, default_after)
+    status_code, delay, rules = response_parser.parse(text)
+    rules = tuple(rule.freeze(is_template) for rule in rules)
+    placeholders = Placeholders(text, rules) if is_template else None
+    json_paths = {rule.selector_target for rule in rules if rule.selector_type == "JSON"}
+    json_paths.update(m.group(1)[5:] for m in ref_pat.finditer(text) if m.group(1).startswith("json."))
+    json_paths = frozenset(path for path in json_paths if not ref_pat.search(path))
+    return CompiledRules(status_code, delay, rules, placeholders, DispatchIndex(rules), json_paths)
+
+
+def compile_rules(rule_source, default_status_code, default_delay, default_after, text, is_template=False):
+    # the request path is not part of the key since it only affects rule ids for match counting
+    key = (rule_source, default_status_code, default_delay, default_after, text, is_template)
+    return rules_cache.get(key, lambda: parse_rules(*key))
+
+
+class Rules:
+    def __init__(self, request_path, compiled, render=no_render):
         self.request_path = request_path
-        response_parser = ResponseParser(rule_source, default_status_code, default_delay, default_after)
-        self.status_code, self.delay, self.rules = response_parser.parse(text)
+        self.status_code = compiled.status_code
+        self.delay = compiled.delay
+        self.rules = compiled.rules
+        self.index = compiled.index
+        self.render = render  # binds request values to any placeholders left in the rules
 
     def num_rules(self):
         return len(self.rules)
 
     def select_content_from_list(self, rule):
         rule_id = rule.unique_id(self.request_path)
-        match_count = rule_match_count.get(rule_id, 0)
-        rule_match_count[rule_id] = match_count + 1
+        match_count = state.next_match(rule_id)
+        metrics.count("rule", rule_id)
 
-        offset = match_count % len(rule.values)
+        offset = match_count % len(rule.sequence)
         return rule.at_offset(offset)
 
-    def rule_selector_generator(self, headers, params, json):
-        for rule in self.rules:
+    def rule_selector_generator(self, facets):
+        last_reset_time_in_millis = state.last_reset_time()
+        for index in self.index.candidates(facets):
+            rule = self.rules[index].bind_selector(self.render)
             millis_since_reset = current_time_in_millis() - last_reset_time_in_millis
-            apply_rule = rule.apply(headers, params, json, millis_since_reset)
+            apply_rule = rule.apply(facets, millis_since_reset)
             if apply_rule:
-                # we get a list of rules here since there could be multiple locations in sequenced content
-                rules = self.select_content_from_list(rule)
+                # there could be multiple locations in sequenced content, each yielded in turn
+                entry = self.select_content_from_list(rule)
                 # once a match is made on one rule, we can stop checking for more rules so all
-                # the rules will not necessarily be yielded or "pulled through" via next()
-                for _ in rules:
-                    yield _
+                # the contents will not necessarily be yielded or "pulled through" via next()
+                for location, value in entry.contents:
+                    yield rule, entry, location, value
@@ -37,7 +37,7 @@ class RulesAdjuster:
         rule.headers.append(headers)
 
     def rule_content_begins_with_header(self, lines, headers):
-        m = re.match(self.header_line_pat, lines[0])
+        m = self.header_line_pat.match(lines[0])
         if m:
             headers[m.group(1)] = m.group(2)
             lines.pop(0)
@@ -1,9 +1,13 @@
 # import string
 
-from .rules import Rules
+from .include_graph import include_graph, IncludeCycleError
+from .metrics import metrics
+from .placeholders import compile_template
+from .request_facets import RequestFacets
+from .response_files import response_files, StaticFile
+from .rules import compile_rules, Rules
 
-import os
-import re
+import functools
 
 
 # allow_undefined_param_refs = True
@@ -20,58 +24,99 @@ import re
 #         return val
 
 
+@functools.lru_cache(maxsize=1024)
+def parse_reference(ref):
+    # the facet and key of a parameter reference, eg: ("header", "Content-Type") for "header.content-type"
+    if ref.startswith("json."):
+        return "json", ref[5:]
+    elif ref.startswith("header."):
+        return "header", ref[7:].title()
+    else:
+        return "param", ref
+
+
 class RulesTemplate:
     def __init__(self, request_path="", text=""):
         self.request_path = request_path
         self.text = text
+        self.rule_ids = []  # ids of the rules selected, in the order they were selected, eg: through nested files
 
     @staticmethod
-    def resolve_value(value, headers, params, json):
-        def resolve_reference(match_obj):
-            ref = match_obj.group(1)
-            try:
-                if ref.startswith("json."):
-                    fmt = "{" + ref + "}"
-                    return fmt.format(json=json)
-
-                elif ref.startswith("header."):
-                    key = ref[7:].title()
-                    return headers[key]
-                else:
-                    return params[ref]
-            except Exception:
-                return ""
+    def resolve_reference(ref, facets):
+        try:
+            facet, key = parse_reference(ref)
+            if facet == "json":
+                return facets.json_text(key)
+            elif facet == "header":
+                return facets.headers[key]
+            else:
+                return facets.params[key]
+        except Exception:
+            return ""
 
-        return re.sub(r"{(\w*([.-]\w*)*)}", resolve_reference, value)
+    @staticmethod
+    def resolve_value(value, facets):
+        return compile_template(value).render(lambda ref: RulesTemplate.resolve_reference(ref, facets))
 
     @staticmethod
     def load_file(file):
-        path = os.path.join("responses", file)
-        with open(path, "r") as fh:
-            text = fh.read()
-        return text
+        return response_files.load(file).content()
 
     def resolve(self, headers, params, json):
+        delay, status, headers, content = self.resolve_response(RequestFacets.of(headers, params, json))
+        headers = dict(headers)
+        if isinstance(content, bytes):
+            content = content.decode()
+        elif isinstance(content, StaticFile):
+            content = content.content()
+        return delay, status, headers, content
+
+    def resolve_response(self, facets):
+        # like resolve(), but the content of files returned verbatim is already encoded, or is a StaticFile to stream
         default_status_code = 200
         default_delay = 0
         default_after = 0
-        text = self.resolve_value(self.text, headers, params, json)
-        return self.select_content("", default_status_code, default_delay, default_after, text, headers, params, json)
-
-    def resolve_file(self, file, default_status_code, default_delay, default_after, headers, params, json, level):
-        text = self.load_file(file)
-        if not file.endswith(".echo"):
-            return default_delay, default_status_code, {}, text
-        text = self.resolve_value(text, headers, params, json)
+        return self.select_content("", default_status_code, default_delay, default_after, self.text, facets)
+
+    def resolve_file(self, file, default_status_code, default_delay, default_after, facets, chain):
+        with facets.timer.phase("load", file):
+            if default_after == 0:
+                # skip over files that only include another file
+                file = include_graph.forward(file)
+            if file in chain:
+                # eg: a file included through a parameter reference that includes itself
+                raise IncludeCycleError(f"include cycle: {' -> '.join(chain[chain.index(file) :] + (file,))}")
+
+            response_file = include_graph.load(file)
+        metrics.count("file", file)
+        if isinstance(response_file, StaticFile):
+            return default_delay, default_status_code, {}, response_file
+        if response_file.data is not None:
+            return default_delay, default_status_code, {}, response_file.data
         return self.select_content(
-            file, default_status_code, default_delay, default_after, text, headers, params, json, level
+            file, default_status_code, default_delay, default_after, response_file.text, facets, chain + (file,)
         )
 
-    def select_content(
-        self, rule_source, default_status_code, default_delay, default_after, text, headers, params, json, level=0
-    ):
-        rules = Rules(self.request_path, rule_source, default_status_code, default_delay, default_after, text)
-        rule_selector = rules.rule_selector_generator(headers, params, json)
+    def compile(self, rule_source, default_status_code, default_delay, default_after, text, facets):
+        # parse the text with parameter references in place, so the result can be reused for any request
+        with facets.timer.phase("parse", rule_source):
+            compiled = compile_rules(rule_source, default_status_code, default_delay, default_after, text, True)
+        facets.expect_json_paths(compiled.json_paths)
+        render = compiled.placeholders.bind(lambda ref: self.resolve_reference(ref, facets))
+        if render is not None:
+            return Rules(self.request_path, compiled, render)
+
+        # the references may affect the structure of the rules, so they must be resolved before parsing
+        with facets.timer.phase("render", rule_source):
+            text = self.resolve_value(text, facets)
+        with facets.timer.phase("parse", rule_source):
+            compiled = compile_rules(rule_source, default_status_code, default_delay, default_after, text)
+        facets.expect_json_paths(compiled.json_paths)
+        return Rules(self.request_path, compiled)
+
+    def select_content(self, rule_source, default_status_code, default_delay, default_after, text, facets, chain=()):
+        rules = self.compile(rule_source, default_status_code, default_delay, default_after, text, facets)
+        rule_selector = rules.rule_selector_generator(facets)
 
         delay = rules.delay
         headers = {}
@@ -85,24 +130,32 @@ class RulesTemplate:
 
         while content is None:
             try:
-                rule = next(rule_selector)
+                with facets.timer.phase("match", rule_source):
+                    rule, entry, location, value = next(rule_selector)
+                self.rule_ids.append(rule.unique_id(self.request_path))
             except StopIteration:
                 # there are no more matching rules
                 # if this is the top-level call, return "" instead of None
-                if level == 0:
+                if not chain:
                     content = ""
                 break
 
             delay = rule.delay
             after = rule.after
-            headers = rule.headers
+            if entry.is_static:
+                headers = entry.headers
+            else:
+                with facets.timer.phase("render", rule_source):
+                    headers = {rules.render(name): rules.render(value) for name, value in entry.headers}
             status = rule.status_code
-            content = "".join(rule.values)
-
-            if rule.location == "file":
-                file = content.strip()
-                delay, status, headers, content = self.resolve_file(
-                    file, status, delay, after, headers, params, json, level + 1
-                )
+            if location == "file":
+                with facets.timer.phase("render", rule_source):
+                    file = rules.render(value).strip()
+                delay, status, headers, content = self.resolve_file(file, status, delay, after, facets, chain)
+            elif entry.body is not None:
+                content = entry.body
+            else:
+                with facets.timer.phase("render", rule_source):
+                    content = rules.render.encode(value)
 
         return delay, status, headers, content
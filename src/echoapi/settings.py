@@ -0,0 +1,53 @@
+import os
+
+
+def env_int(name, default):
+    value = os.environ.get(name, "")
+    return int(value) if value.strip() else default
+
+
+# maximum number of parsed rules specifications kept in memory, 0 to disable caching
+rules_cache_size = env_int("ECHO_API_RULES_CACHE_SIZE", 1024)
+
+# directory response files are loaded from
+responses_dir = os.environ.get("ECHO_API_RESPONSES_DIR", "responses")
+
+# maximum total size of response files kept in memory, in bytes
+response_files_max_bytes = env_int("ECHO_API_RESPONSE_FILES_MAX_BYTES", 64 * 1024 * 1024)
+
+# minimum time between checks for a modified response file, in milliseconds, 0 to check on every use
+response_files_check_interval = env_int("ECHO_API_RESPONSE_FILES_CHECK_INTERVAL", 0)
+
+# response files (other than .echo files) at least this big are streamed from disk rather than kept in memory
+static_file_min_bytes = env_int("ECHO_API_STATIC_FILE_MIN_BYTES", 256 * 1024)
+
+# json request bodies at least this big only have the fields the rules use extracted, rather than being decoded,
+# 0 to always decode the whole body
+json_stream_min_bytes = env_int("ECHO_API_JSON_STREAM_MIN_BYTES", 64 * 1024)
+
+# file rule match counts are kept in, so they are shared by all worker processes, empty to keep them in memory
+state_file = os.environ.get("ECHO_API_STATE_FILE", "")
+
+# load and compile every .echo file in the responses directory at startup, 1 to enable
+warm_up = env_int("ECHO_API_WARM_UP", 0)
+
+# number of processes compiling .echo files during warm-up, 0 for one per core
+warm_up_workers = env_int("ECHO_API_WARM_UP_WORKERS", 0)
+
+# time the phases of each request, returned in a Server-Timing header and summarized in _echo_stats, 1 to enable
+timing = env_int("ECHO_API_TIMING", 0)
+
+# maximum number of request paths, and of rule sources, with their own timing histograms
+timing_max_keys = env_int("ECHO_API_TIMING_MAX_KEYS", 1000)
+
+# file each request is appended to, as json lines that python -m echoapi.replay can read, empty to not record
+record_file = os.environ.get("ECHO_API_RECORD_FILE", "")
+
+# size the record file may grow to before it is rotated, eg: requests.jsonl to requests.jsonl.1
+record_max_bytes = env_int("ECHO_API_RECORD_MAX_BYTES", 64 * 1024 * 1024)
+
+# number of rotated record files kept
+record_backups = env_int("ECHO_API_RECORD_BACKUPS", 5)
+
+# maximum number of requests waiting to be written, beyond which requests are not recorded
+record_queue_size = env_int("ECHO_API_RECORD_QUEUE_SIZE", 10000)
@@ -0,0 +1,104 @@
+from .settings import state_file
+
+import sqlite3
+import threading
+
+
+class LocalState:
+    """Rule match counts and reset time kept in this process"""
+
+    num_stripes = 16  # counts are split between stripes, so requests for different rules rarely wait on each other
+
+    def __init__(self):
+        self.stripes = [(threading.Lock(), {}) for _ in range(self.num_stripes)]
+        self.reset_time = 0
+
+    def stripe(self, rule_id):
+        return self.stripes[hash(rule_id) % self.num_stripes]
+
+    def next_match(self, rule_id):
+        # returns the number of earlier matches of the rule, and counts this one
+        lock, counts = self.stripe(rule_id)
+        with lock:
+            match_count = counts.get(rule_id, 0)
+            counts[rule_id] = match_count + 1
+        return match_count
+
+    def last_reset_time(self):
+        return self.reset_time
+
+    def reset(self, reset_time):
+        # take every lock, always in the same order, so a reset is never seen half done
+        for lock, _ in self.stripes:
+            lock.acquire()
+        try:
+            self.reset_time = reset_time
+            for _, counts in self.stripes:
+                counts.clear()
+        finally:
+            for lock, _ in self.stripes:
+                lock.release()
+
+    def match_counts(self):
+        match_counts = {}
+        for lock, counts in self.stripes:
+            with lock:
+                match_counts.update(counts)
+        return match_counts
+
+
+class SharedState:
+    """Rule match counts and reset time kept in a SQLite database shared by all worker processes"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()  # sqlite connections may not be shared between threads
+        connection = self.connection()
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS match_count (rule_id TEXT PRIMARY KEY, count INTEGER)")
+            connection.execute("CREATE TABLE IF NOT EXISTS reset (id INTEGER PRIMARY KEY, time INTEGER)")
+            connection.execute("INSERT OR IGNORE INTO reset VALUES (0, 0)")
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            # autocommit mode, so BEGIN IMMEDIATE below controls locking
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            self.local.connection = connection
+        return connection
+
+    def next_match(self, rule_id):
+        # read and increment the count in one write transaction, so no two workers see the same count
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute("SELECT count FROM match_count WHERE rule_id = ?", (rule_id,)).fetchone()
+            match_count = row[0] if row else 0
+            connection.execute("INSERT OR REPLACE INTO match_count VALUES (?, ?)", (rule_id, match_count + 1))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return match_count
+
+    def last_reset_time(self):
+        return self.connection().execute("SELECT time FROM reset WHERE id = 0").fetchone()[0]
+
+    def reset(self, reset_time):
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute("UPDATE reset SET time = ? WHERE id = 0", (reset_time,))
+            connection.execute("DELETE FROM match_count")
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def match_counts(self):
+        return dict(self.connection().execute("SELECT rule_id, count FROM match_count"))
+
+
+state = SharedState(state_file) if state_file else LocalState()
@@ -0,0 +1,177 @@
+from .settings import timing, timing_max_keys
+
+import bisect
+import contextlib
+import threading
+import time
+
+
+# phases of handling a request, in the order they are reported
+phases = ("decode", "parse", "match", "load", "render", "delay")
+
+# upper bounds of the histogram buckets, in milliseconds, with a last bucket for anything slower
+bucket_bounds = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Timer:
+    """Time spent in each phase of one request, not counting the time spent in phases nested inside it"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.mark = self.start  # when the innermost phase was entered or resumed
+        self.stack = []  # (phase, rule source) of the phases entered and not yet left
+        self.seconds = {}  # phase -> seconds
+        self.source_seconds = {}  # (rule source, phase) -> seconds
+        self.deferred = 0.0  # delay waited out by the server after the response is returned (see asgi.py)
+        self.total = None
+
+    def phase(self, name, source=None):
+        # eg: with timer.phase("parse", "pets.echo"): ...
+        return Phase(self, name, source)
+
+    def enter(self, name, source):
+        self.pause()
+        self.stack.append((name, source))
+
+    def leave(self):
+        self.pause()
+        self.stack.pop()
+
+    def pause(self):
+        # charge the time since the last mark to the innermost phase
+        now = time.perf_counter()
+        if self.stack:
+            self.add(*self.stack[-1], now - self.mark)
+        self.mark = now
+
+    def add(self, name, source, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        if source is not None:
+            key = (source, name)
+            self.source_seconds[key] = self.source_seconds.get(key, 0.0) + seconds
+
+    def defer(self, seconds):
+        self.add("delay", None, seconds)
+        self.deferred += seconds
+
+    def stop(self):
+        self.total = time.perf_counter() - self.start + self.deferred
+
+    def server_timing(self):
+        # eg: "parse;dur=0.412, match;dur=0.023, delay;dur=100.000, total;dur=100.561"
+        metrics = [f"{name};dur={self.seconds[name] * 1000:.3f}" for name in phases if name in self.seconds]
+        metrics.append(f"total;dur={self.total * 1000:.3f}")
+        return ", ".join(metrics)
+
+
+class Phase:
+    __slots__ = ("timer", "name", "source")
+
+    def __init__(self, timer, name, source):
+        self.timer = timer
+        self.name = name
+        self.source = source
+
+    def __enter__(self):
+        self.timer.enter(self.name, self.source)
+
+    def __exit__(self, *exc_info):
+        self.timer.leave()
+
+
+class NoTimer:
+    """Stands in for a Timer when timing is disabled"""
+
+    null_phase = contextlib.nullcontext()
+
+    def phase(self, name, source=None):
+        return self.null_phase
+
+    def defer(self, seconds):
+        pass
+
+
+no_timer = NoTimer()
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(bucket_bounds) + 1)
+        self.count = 0
+        self.sum = 0.0  # milliseconds
+
+    def observe(self, millis):
+        self.counts[bisect.bisect_left(bucket_bounds, millis)] += 1
+        self.count += 1
+        self.sum += millis
+
+    def stats(self):
+        # cumulative counts, as [upper bound, count] pairs, eg: [[0.05, 0], [0.1, 3],... ["+Inf", 7]]
+        buckets = []
+        cumulative = 0
+        for bound, count in zip(bucket_bounds + ("+Inf",), self.counts):
+            cumulative += count
+            buckets.append([bound, cumulative])
+        return {"count": self.count, "sum_ms": round(self.sum, 3), "buckets": buckets}
+
+
+class Timings:
+    """Histograms of phase durations, by request path and by rule source"""
+
+    other = "(other)"  # key for paths or sources beyond the first max_keys of each
+    inline = "(inline)"  # rule source of the rules given in the _echo_response parameter
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self.paths = {}  # request path -> phase -> Histogram
+        self.sources = {}  # rule source -> phase -> Histogram
+        self.lock = threading.Lock()
+
+    def record(self, request_path, timer):
+        with self.lock:
+            histograms = self.histograms(self.paths, request_path)
+            for name, seconds in timer.seconds.items():
+                self.observe(histograms, name, seconds)
+            self.observe(histograms, "total", timer.total)
+
+            for (source, name), seconds in timer.source_seconds.items():
+                self.observe(self.histograms(self.sources, source or self.inline), name, seconds)
+
+    def histograms(self, by_key, key):
+        histograms = by_key.get(key)
+        if histograms is None:
+            if len(by_key) >= self.max_keys:
+                key = self.other
+            histograms = by_key.setdefault(key, {})
+        return histograms
+
+    @staticmethod
+    def observe(histograms, name, seconds):
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.observe(seconds * 1000)
+
+    def clear(self):
+        with self.lock:
+            self.paths.clear()
+            self.sources.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "enabled": bool(timing),
+                "paths": self.by_key_stats(self.paths),
+                "sources": self.by_key_stats(self.sources),
+            }
+
+    @staticmethod
+    def by_key_stats(by_key):
+        return {key: {name: h.stats() for name, h in histograms.items()} for key, histograms in by_key.items()}
+
+
+def new_timer():
+    return Timer() if timing else no_timer
+
+
+timings = Timings(timing_max_keys)
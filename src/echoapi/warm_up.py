@@ -0,0 +1,104 @@
+from .include_graph import include_graph
+from .response_files import response_files
+from .rules import parse_rules
+from .rules_cache import rules_cache
+from .settings import responses_dir, warm_up_workers
+
+from concurrent.futures import ProcessPoolExecutor
+
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+
+def echo_files(root):
+    # paths of the .echo files under root, relative to it, as used in file: locations
+    files = []
+    for dir_path, _, names in os.walk(root):
+        for name in names:
+            if name.endswith(".echo"):
+                files.append(os.path.relpath(os.path.join(dir_path, name), root))
+    return sorted(files)
+
+
+def compile_file(root, file):
+    # runs in a worker process, returns (file, text, compiled rules, error, seconds, bytes of memory used)
+    start = time.perf_counter()
+    tracemalloc.start()
+    try:
+        with open(os.path.join(root, file), "r") as fh:
+            text = fh.read()
+        compiled = parse_rules(file, 200, 0, 0, text, True)
+        num_bytes = tracemalloc.get_traced_memory()[0]
+        return file, text, compiled, None, time.perf_counter() - start, num_bytes
+    except Exception as e:
+        return file, None, None, f"{type(e).__name__}: {e}", time.perf_counter() - start, 0
+    finally:
+        tracemalloc.stop()
+
+
+class WarmUp:
+    """Loads and compiles every .echo file before the server reports it is ready"""
+
+    def __init__(self, root, workers):
+        self.root = root
+        self.workers = workers or os.cpu_count()
+        self.state = "idle"  # then "running", then "done"
+        self.files = 0
+        self.errors = {}  # file -> error message
+        self.seconds = 0.0
+
+    def is_ready(self):
+        return self.state != "running"
+
+    def start(self):
+        self.state = "running"
+        threading.Thread(target=self.run, name="echoapi-warm-up", daemon=True).start()
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            self.warm_up()
+        except Exception as e:
+            print(f"WARM-UP: failed, {type(e).__name__}: {e}", file=sys.stderr)
+        self.seconds = time.perf_counter() - start
+        print(f"WARM-UP: {self.files} files, {len(self.errors)} errors, {self.seconds:.2f}s", file=sys.stderr)
+        self.state = "done"
+
+    def warm_up(self):
+        files = echo_files(self.root)
+        # spawn rather than fork, since the server may already be running threads
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(self.workers, mp_context=context) as pool:
+            results = list(pool.map(compile_file, [self.root] * len(files), files, chunksize=8))
+
+        for file, text, compiled, error, seconds, num_bytes in results:
+            if error is None:
+                error = self.add(file, text, compiled)
+            if error is None:
+                print(f"WARM-UP: {seconds * 1000:8.1f}ms {num_bytes / 1024:8.1f}KB {file}", file=sys.stderr)
+            else:
+                self.errors[file] = error
+                print(f"WARM-UP: error in {file}: {error}", file=sys.stderr)
+            self.files += 1
+
+    def add(self, file, text, compiled):
+        # keep the file and its compiled rules, as if it had been used with the default options
+        try:
+            entry = response_files.load(file)
+            if entry.content() != text:
+                return None  # modified since it was compiled, so it is compiled when used
+            include_graph.load(file)
+        except Exception as e:
+            return f"{type(e).__name__}: {e}"
+        rules_cache.put((file, 200, 0, 0, text, True), compiled)
+        return None
+
+    def stats(self):
+        return {"state": self.state, "files": self.files, "errors": self.errors, "seconds": round(self.seconds, 3)}
+
+
+warm_up = WarmUp(responses_dir, warm_up_workers)
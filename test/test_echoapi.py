@@ -1,13 +1,41 @@
 #!/usr/bin/env python
 
 from box import Box
+from echoapi import replay
+from echoapi.asgi import app as asgi_app
+from echoapi.dispatch_index import exact_literal
+from echoapi.include_graph import IncludeCycleError, IncludeGraph
+from echoapi.json_path import compile_path, json_text, missing, walk
+from echoapi.json_stream import JsonExtractor
+from echoapi.metrics import Metrics
+from echoapi.placeholders import compile_template, ref_pat, Renderer
+from echoapi.recorder import Recorder
+from echoapi.request_facets import RequestFacets
+from echoapi.response_files import ResponseFileStore, StaticFile
+from echoapi.routes import app
+from echoapi.rule import RuleError, sequence_contents
+from echoapi.rules import compile_rules
+from echoapi.rules_cache import RulesCache
 from echoapi.rules_template import RulesTemplate
-
+from echoapi.state import LocalState, SharedState
+from echoapi.timing import Timer, Timings
+from echoapi.warm_up import WarmUp
+
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import pickle
 import requests
 import sys
+import tempfile
+import threading
 import time
 import timeit
 import unittest
+import unittest.mock
+import urllib.parse
 
 
 # -----------------------------------------------------------------------------------------------------------------------
@@ -1225,3 +1253,741 @@ class TestAfterOption(TestEchoServer):
         # self.after_case(url, 'Alfalfa Sprouts\n', 180, 'Bengal Tiger\n')
 
         self.after_case(url, "", 180, "Bengal Tiger\n")
+
+
+class TestRulesCache(unittest.TestCase):
+    def test_compiled_rules_are_shared(self):
+        text = "201 PARAM:color /green/ cached"
+        first = compile_rules("", 200, 0, 0, text)
+        second = compile_rules("", 200, 0, 0, text)
+        self.assertIs(first, second)
+        self.assertEqual(first.status_code, 201)
+        self.assertIsInstance(first.rules, tuple)
+        self.assertEqual(first.rules[0].sequence, (((), (("text", ("cached",)),), b"cached", True),))
+
+    def test_hits_misses_and_evictions(self):
+        cache = RulesCache(2)
+        cache.get("a", lambda: 1)
+        cache.get("b", lambda: 2)
+        cache.get("a", lambda: 1)
+        cache.get("c", lambda: 3)  # evicts "b", the least recently used
+        self.assertEqual(cache.get("b", lambda: 4), 4)
+        self.assertEqual(cache.stats(), {"size": 2, "max_size": 2, "hits": 1, "misses": 4, "evictions": 2})
+
+
+class TestPlaceholders(unittest.TestCase):
+    def resolve(self, text, **params):
+        delay, status, headers, content = RulesTemplate("/it", text).resolve(headers={}, params=params, json=Box())
+        return status, content
+
+    def test_one_compiled_spec_for_any_parameter_values(self):
+        text = "PARAM:kind /{want}/ text:Some {kind} wanted\ntext:Some {kind} unwanted"
+        compiled = compile_rules("", 200, 0, 0, text, True)
+        self.assertTrue(compiled.placeholders.is_bindable)
+        self.assertEqual(self.resolve(text, kind="fig", want="fig"), (200, "Some fig wanted\n"))
+        self.assertEqual(self.resolve(text, kind="kiwi", want="fig"), (200, "Some kiwi unwanted"))
+        self.assertIs(compile_rules("", 200, 0, 0, text, True), compiled)
+
+    def test_structural_reference_is_resolved_before_parsing(self):
+        text = "{code} text:gorilla"
+        self.assertFalse(compile_rules("", 200, 0, 0, text, True).placeholders.is_bindable)
+        self.assertEqual(self.resolve(text, code="210"), (210, "gorilla"))
+
+    def test_structural_value_is_resolved_before_parsing(self):
+        text = "Hello {name}"
+        self.assertEqual(self.resolve(text, name="Sue"), (200, "Hello Sue"))
+        self.assertEqual(self.resolve(text, name="Bob\nPARAM:x /y/ z"), (200, "Hello Bob\n"))
+
+    def test_value_with_marker_and_keyword_is_resolved_before_parsing(self):
+        text = "PARAM:id /^{want}$/ 200 text:wanted\nPARAM:{name} /./ 201 text:named\ntext:neither"
+        self.assertTrue(compile_rules("", 200, 0, 0, text, True).placeholders.is_bindable)
+        for want, name in (("a|text:x", "n"), ("b", "id|text:"), ("b", "a|PARAM:id")):
+            resolved = text.replace("{want}", want).replace("{name}", name)
+            self.assertEqual(self.resolve(text, want=want, name=name, id="a"), self.resolve(resolved, id="a"))
+
+    def test_reference_after_marker_is_resolved_before_parsing(self):
+        text = "PARAM:id /x/ text:first |{json.missing}PARAM:id /y/ text:second"
+        self.assertFalse(compile_rules("", 200, 0, 0, text, True).placeholders.is_bindable)
+        self.assertEqual(self.resolve(text, id="y"), (200, "second"))
+
+    def test_reference_in_comment_is_resolved_before_parsing(self):
+        text = "# {note}\ntext:plain"
+        self.assertFalse(compile_rules("", 200, 0, 0, text, True).placeholders.is_bindable)
+        self.assertEqual(self.resolve(text, note="x\n201 text:noted"), (201, "noted\n"))
+
+
+class TestCompiledRule(unittest.TestCase):
+    text = "PARAM:id /7/ 201 file:a.echo\n--[ 1 ]--\nHEADER: X-Step: one\nfile:b.txt\nfirst\n--[ 2 ]--\nsecond\n"
+
+    def test_sequence_entries(self):
+        rule = compile_rules("", 200, 0, 0, self.text).rules[0]
+        self.assertEqual(len(rule.sequence), 2)
+        self.assertEqual(rule.at_offset(0).headers, (("X-Step", "one"),))
+        self.assertEqual(rule.at_offset(1).contents, (("text", ("second\n",)),))
+        self.assertIs(rule.at_offset(1), rule.at_offset(1))
+        self.assertEqual(rule.unique_id("/it"), "/it::PARAM:id:/7/:0")
+
+    def test_sequence_contents_without_values(self):
+        self.assertEqual(sequence_contents(["file", "file"], ["a.echo"]), (("file", "a.echo"),))
+        self.assertEqual(sequence_contents(["file", "text"], ["a.echo"]), (("file", "a.echo"),))
+        self.assertEqual(sequence_contents(["text"], ["a\n", "b"]), (("text", ("a\n", "b")),))
+        self.assertEqual(sequence_contents(["file"], []), ())
+
+    def test_encoded_body(self):
+        text = "PARAM:id /7/\n--[ 1 ]--\nHEADER: X-Id: {id}\nid {id}\n--[ 2 ]--\nHEADER: X-Step: two\nsame ü"
+        first, second = compile_rules("", 200, 0, 0, text, True).rules[0].sequence
+        self.assertEqual((first.body, first.is_static), (None, False))
+        self.assertEqual((second.body, second.is_static), ("same ü".encode(), True))
+
+        # the same bytes are returned for every response
+        template = RulesTemplate("/it", "text:same ü")
+        facets = RequestFacets.of({}, {}, Box())
+        self.assertIs(template.resolve_response(facets)[3], template.resolve_response(facets)[3])
+
+    def test_immutable_and_picklable(self):
+        rule = compile_rules("", 200, 0, 0, self.text).rules[0]
+        with self.assertRaises(AttributeError):
+            rule.delay = 5
+        with self.assertRaises(AttributeError):
+            rule.extra = 5
+        copy = pickle.loads(pickle.dumps(rule))
+        self.assertEqual((copy.sequence, copy.regex, copy.id_suffix), (rule.sequence, rule.regex, rule.id_suffix))
+
+
+class TestTemplate(unittest.TestCase):
+    values = {"a": "1", "json.b": "{a}", "c-d": "ü"}
+
+    def test_same_text_as_substitution(self):
+        for text in ["", "plain", "{a}", "x{a}y{json.b}z{c-d}", "{a}{a}", "{ a} {} {x!} {a", "a\n{c-d}\n"]:
+            expected = ref_pat.sub(lambda match_obj: self.values.get(match_obj.group(1), "?"), text)
+            self.assertEqual(compile_template(text).render(lambda ref: self.values.get(ref, "?")), expected)
+            self.assertEqual(compile_template(text).encode(lambda ref: self.values.get(ref, "?")), expected.encode())
+
+    def test_literal_text_is_encoded_once(self):
+        lines = ("static ", "text ü\n")
+        self.assertEqual(Renderer().encode(lines), "static text ü\n".encode())
+        self.assertIs(Renderer().encode(lines), Renderer({"a": "1"}).encode(lines))
+        self.assertEqual(Renderer().encode(("{a}",)), b"{a}")
+
+
+class TestRulePatterns(unittest.TestCase):
+    def test_patterns_compiled_when_parsed(self):
+        rule = compile_rules("", 200, 0, 0, "PARAM:color !/GREEN/i not green").rules[0]
+        self.assertEqual(rule.regex.pattern, "GREEN")
+        self.assertFalse(rule.is_positive)
+        self.assertTrue(rule._matches("blue"))
+        self.assertFalse(rule._matches("Green"))
+
+    def test_invalid_pattern_fails_when_parsed(self):
+        with self.assertRaises(RuleError):
+            compile_rules("", 200, 0, 0, "PARAM:color /gr(een/ broken")
+
+
+class TestResponseFiles(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = ResponseFileStore(self.dir.name, 20, 0, 1000)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, file, text, mtime):
+        path = os.path.join(self.dir.name, file)
+        with open(path, "w") as fh:
+            fh.write(text)
+        os.utime(path, (mtime, mtime))
+
+    def test_loaded_once_until_modified(self):
+        self.write("a.echo", "PATH: /./ one", 1000)
+        self.assertEqual(self.store.load("a.echo").text, "PATH: /./ one")
+        self.assertEqual(self.store.load("a.echo").text, "PATH: /./ one")
+        self.write("a.echo", "PATH: /./ two", 2000)
+        self.assertEqual(self.store.load("a.echo").text, "PATH: /./ two")
+        self.assertEqual((self.store.hits, self.store.misses, self.store.reloads), (1, 1, 1))
+
+    def test_verbatim_files_are_encoded(self):
+        self.write("a.json", '{ "a": 1 }', 1000)
+        entry = self.store.load("a.json")
+        self.assertEqual(entry.data, b'{ "a": 1 }')
+        self.assertEqual(entry.content(), '{ "a": 1 }')
+
+    def test_verbatim_files_are_not_decoded(self):
+        for file, data in (("crlf.txt", b"a\r\nb\r\n"), ("binary.bin", b"\xff\xfe\x00")):
+            with open(os.path.join(self.dir.name, file), "wb") as fh:
+                fh.write(data)
+            self.assertEqual(self.store.load(file).data, data)
+
+    def test_same_content_whatever_the_size(self):
+        with open(os.path.join(self.dir.name, "crlf.txt"), "wb") as fh:
+            fh.write(b"a\r\nb")
+        small, large = self.store.load("crlf.txt"), ResponseFileStore(self.dir.name, 20, 0, 1).load("crlf.txt")
+        self.assertIsInstance(large, StaticFile)
+        with large.open() as fh:
+            self.assertEqual(fh.read(), small.data)
+        self.assertEqual(large.content(), small.content())
+
+    def test_large_files_are_streamed(self):
+        self.write("big.bin", "b" * 1000, 1000)
+        self.assertIsInstance(self.store.load("big.bin"), StaticFile)
+        self.assertEqual(self.store.stats()["files"], 0)
+
+    def test_streamed_response(self):
+        store = ResponseFileStore("responses", 1000, 0, 0)
+        with unittest.mock.patch("echoapi.rules_template.include_graph", IncludeGraph(store)):
+            resp = app.test_client().get("/?_echo_response=201 file:test/ok.txt")
+        self.assertEqual(store.stats()["files"], 0)
+        self.assertEqual(store.stats()["misses"], 0)
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.content_length, 9)
+        self.assertEqual(resp.get_data(), b"okidoki\n\n")
+
+    def test_memory_cap(self):
+        self.write("a.txt", "x" * 8, 1000)
+        self.write("b.txt", "y" * 8, 1000)
+        self.write("c.txt", "z" * 8, 1000)
+        for file in ("a.txt", "b.txt", "c.txt"):
+            self.store.load(file)
+        self.assertEqual(self.store.stats()["files"], 2)
+        self.assertEqual(self.store.stats()["evictions"], 1)
+
+
+class TestConditionalGet(unittest.TestCase):
+    def get(self, spec, **headers):
+        return app.test_client().get("/", query_string={"_echo_response": spec}, headers=headers)
+
+    def test_static_text(self):
+        resp = self.get("text:polled")
+        self.assertEqual(resp.headers["ETag"], f'"{hashlib.blake2b(b"polled", digest_size=16).hexdigest()}"')
+        again = self.get("text:polled", **{"If-None-Match": resp.headers["ETag"]})
+        self.assertEqual((again.status_code, again.get_data()), (304, b""))
+        self.assertEqual(self.get("text:polled", **{"If-None-Match": '"other"'}).status_code, 200)
+
+    def test_verbatim_file(self):
+        resp = self.get("file:test/ok.txt")
+        self.assertIn("Last-Modified", resp.headers)
+        again = self.get("file:test/ok.txt", **{"If-Modified-Since": resp.headers["Last-Modified"]})
+        self.assertEqual(again.status_code, 304)
+
+    def test_streamed_file(self):
+        store = ResponseFileStore("responses", 1000, 0, 0)
+        with unittest.mock.patch("echoapi.rules_template.include_graph", IncludeGraph(store)):
+            resp = self.get("file:test/ok.txt")
+            again = self.get("file:test/ok.txt", **{"If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(resp.get_data(), b"okidoki\n\n")
+        self.assertEqual((again.status_code, again.get_data()), (304, b""))
+
+    def test_not_for_rendered_or_other_status(self):
+        self.assertNotIn("ETag", self.get("text:id ${params.id}").headers)
+        self.assertNotIn("ETag", self.get("404 text:missing").headers)
+        self.assertEqual(self.get('200\nHEADER: ETag: "mine"\nmine').headers["ETag"], '"mine"')
+
+
+class TestTiming(unittest.TestCase):
+    def test_nested_phases_are_not_counted_twice(self):
+        timer = Timer()
+        with timer.phase("match", "a.echo"):
+            time.sleep(0.01)
+            with timer.phase("decode"):
+                time.sleep(0.02)
+        timer.defer(0.1)
+        timer.stop()
+        self.assertAlmostEqual(timer.seconds["match"], 0.01, delta=0.005)
+        self.assertAlmostEqual(timer.seconds["decode"], 0.02, delta=0.005)
+        self.assertEqual(list(timer.source_seconds), [("a.echo", "match")])
+        self.assertAlmostEqual(timer.total, 0.13, delta=0.01)
+        self.assertRegex(timer.server_timing(), r"^decode;dur=2\d\.\d{3}, match;dur=\d+\.\d{3}, delay;dur=100\.000, ")
+
+    def test_server_timing_and_histograms(self):
+        timings = Timings(1)
+        with unittest.mock.patch("echoapi.timing.timing", 1), unittest.mock.patch("echoapi.routes.timing", 1):
+            with unittest.mock.patch("echoapi.echo_server.timings", timings):
+                client = app.test_client()
+                resp = client.get("/pets/id:7", query_string={"_echo_response": "delay=10ms file:test/ok.txt"})
+                client.get("/other", query_string={"_echo_response": "text:other"})
+        self.assertRegex(resp.headers["Server-Timing"], r"^parse;dur=[\d.]+, match;dur=[\d.]+, load;dur=[\d.]+, ")
+        self.assertRegex(resp.headers["Server-Timing"], r"delay;dur=1\d\.\d{3}, total;dur=[\d.]+$")
+        stats = timings.stats()
+        self.assertEqual(list(stats["paths"]), ["pets/id", "(other)"])
+        self.assertEqual(stats["paths"]["pets/id"]["delay"]["buckets"][6:8], [[5, 0], [10, 0]])
+        self.assertEqual(stats["paths"]["pets/id"]["total"]["count"], 1)
+        self.assertEqual(list(stats["sources"]), ["(inline)", "(other)"])
+        self.assertEqual(stats["sources"]["(inline)"]["match"]["count"], 2)
+        self.assertEqual(list(stats["sources"]["(other)"]), ["load"])
+
+
+class TestMetrics(unittest.TestCase):
+    def test_counts_from_all_threads(self):
+        metrics = Metrics()
+
+        def handle(status_code):
+            metrics.count("rule", 'a"b')
+            metrics.request_done(status_code, 0.002)
+
+        threads = [threading.Thread(target=handle, args=(200 + n % 2,)) for n in range(10)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        handle(200)
+
+        text = metrics.exposition()
+        self.assertIn('echoapi_requests_total{status="200"} 6\n', text)
+        self.assertIn('echoapi_requests_total{status="201"} 5\n', text)
+        self.assertIn('echoapi_rule_matches_total{rule="a\\"b"} 11\n', text)
+        self.assertIn('echoapi_request_duration_seconds_bucket{le="0.001"} 0\n', text)
+        self.assertIn('echoapi_request_duration_seconds_bucket{le="0.0025"} 11\n', text)
+        self.assertEqual(len(metrics.threads), 1)
+        self.assertEqual(metrics.exposition(), text)
+
+    def test_finished_threads_are_not_kept(self):
+        metrics = Metrics()
+        for _ in range(200):
+            thread = threading.Thread(target=metrics.request_done, args=(200, 0.001))
+            thread.start()
+            thread.join()
+        self.assertLessEqual(len(metrics.threads), 1)
+        self.assertIn('echoapi_requests_total{status="200"} 200\n', metrics.exposition())
+
+    def test_endpoint(self):
+        client = app.test_client()
+        client.get("/metered", query_string={"_echo_response": "PARAM:id /7/ file:test/ok.txt"})
+        client.get("/metered", query_string={"id": "7", "_echo_response": "PARAM:id /7/ file:test/ok.txt"})
+        resp = client.get("/_echo_metrics")
+        self.assertEqual(resp.mimetype, "text/plain")
+        self.assertIn('echoapi_rule_matches_total{rule="metered::PARAM:id:/7/:0"} 1\n', resp.get_data(as_text=True))
+        self.assertRegex(resp.get_data(as_text=True), r'echoapi_response_file_uses_total{file="test/ok.txt"} [1-9]')
+        self.assertRegex(resp.get_data(as_text=True), r"echoapi_rules_cache_hit_ratio [\d.]+\n")
+
+
+class TestRecorder(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "requests.jsonl")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_recorded_requests_can_be_replayed(self):
+        recorder = Recorder(self.path, 1024 * 1024, 1, 100)
+        recorder.start()
+        spec = "PARAM:id /7/ 201 file:test/ok.txt\ntext:other"
+        with unittest.mock.patch("echoapi.routes.recorder", recorder), unittest.mock.patch(
+            "echoapi.routes.record_file", self.path
+        ):
+            app.test_client().get("/pets/id:7", query_string={"_echo_response": spec}, headers={"X-Pet": "dog"})
+            app.test_client().post("/pets", query_string={"_echo_response": spec}, json={"a": 1})
+        recorder.flush()
+
+        with open(self.path) as fh:
+            entries = [json.loads(line) for line in fh]
+        self.assertEqual([entry["status"] for entry in entries], [201, 200])
+        self.assertEqual([entry["rule_ids"] for entry in entries], [["pets/id::PARAM:id:/7/:0"], ["pets:::::0"]])
+        self.assertEqual((entries[0]["headers"]["X-Pet"], entries[1]["body"]), ("dog", '{"a": 1}'))
+        self.assertNotIn("Host", entries[0]["headers"])
+
+        captured = replay.load_capture(self.path)
+        self.assertEqual(captured[1][:2], ("POST", "/pets?_echo_response=" + urllib.parse.quote_plus(spec)))
+        self.assertEqual(captured[1][3], b'{"a": 1}')
+
+    def test_rotation_and_full_queue(self):
+        recorder = Recorder(self.path, 100, 2, 3)
+        entry = ("POST", "/it", "", [], b"x" * 40, [], 200)
+        for n in range(5):
+            recorder.record(entry)
+        self.assertEqual((recorder.queue.qsize(), recorder.dropped), (3, 2))
+        recorder.start()
+        recorder.flush()
+        for n in range(10):
+            recorder.record(entry)
+            recorder.flush()
+        self.assertEqual(sorted(os.listdir(self.dir.name))[-2:], ["requests.jsonl.1", "requests.jsonl.2"])
+        self.assertEqual(recorder.stats()["recorded"], 13)
+
+    def test_stop_writes_queued_requests(self):
+        recorder = Recorder(self.path, 1024 * 1024, 1, 1000)
+        entry = ("GET", "/it", "", [], b"", [], 200)
+        threads = [threading.Thread(target=lambda: [recorder.record(entry) for _ in range(100)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        recorder.start()
+        for thread in threads:
+            thread.join()
+        recorder.stop()
+        self.assertFalse(recorder.thread.is_alive())
+        with open(self.path) as fh:
+            self.assertEqual(len(fh.readlines()), 400)
+        self.assertEqual((recorder.stats()["recorded"], recorder.dropped, recorder.fh), (400, 0, None))
+
+
+class TestReplay(unittest.TestCase):
+    def test_load_capture(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl") as fh:
+            fh.write(
+                '{"path": "pets", "params": {"id": 7}, "headers": {"x-a": 1}}\n\n{"request_id": "not a request"}\n'
+            )
+            fh.write('{"method": "post", "path": "/pets", "json": {"a": 1}}\n')
+            fh.flush()
+            captured = replay.load_capture(fh.name)
+        self.assertEqual(
+            captured,
+            [
+                ("GET", "/pets?id=7", {"X-A": "1"}, b""),
+                ("POST", "/pets", {"Content-Type": "application/json"}, b'{"a": 1}'),
+            ],
+        )
+
+    def test_summary(self):
+        self.assertEqual(replay.server_timing_delay({"server-timing": "match;dur=0.1, delay;dur=20.000"}), 0.02)
+        self.assertEqual(replay.server_timing_delay({"server-timing": "match;dur=0.1, total;dur=0.2"}), 0.0)
+        self.assertIsNone(replay.server_timing_delay({}))
+        self.assertEqual([replay.percentile(list(range(1, 101)), f) for f in (0.5, 0.95, 0.99)], [50, 95, 99])
+
+        results = [replay.Result(200, 0.1 + n / 1000, 0.1) for n in range(10)] + [replay.Result(None, 1, None)]
+        summary = replay.summarize(results, 2.0)
+        self.assertEqual(summary["statuses"], {"200": 10, "error": 1})
+        self.assertEqual(summary["requests_per_sec"], 5.0)
+        self.assertEqual(summary["delay_ms"]["p99"], 100.0)
+        self.assertEqual(summary["overhead_ms"]["p50"], 4.0)
+
+    def test_replay(self):
+        spec = "PARAM:id /7/ 201 delay=10ms text:seven\ntext:other"
+        captured = [replay.request_of({"path": "/pets/id:7", "params": {"_echo_response": spec}})]
+        captured.append(replay.request_of({"method": "HEAD", "path": "/pets", "params": {"_echo_response": spec}}))
+        results, seconds = asyncio.run(replay.replay("http://127.0.0.1:5000", captured, 20, 4))
+        self.assertEqual(sorted(result.status for result in results), [200] * 10 + [201] * 10)
+        self.assertGreater(min(result.seconds for result in results if result.status == 201), 0.01)
+
+    def test_recorded_path_is_replayed(self):
+        with tempfile.TemporaryDirectory() as root:
+            recorder = Recorder(os.path.join(root, "requests.jsonl"), 1024 * 1024, 1, 100)
+            recorder.start()
+            spec = "PARAM:id /^1$/ 201 text:one\ntext:other"
+            with unittest.mock.patch("echoapi.routes.recorder", recorder), unittest.mock.patch(
+                "echoapi.routes.record_file", recorder.path
+            ):
+                app.test_client().get("/a b/id:1", query_string={"_echo_response": spec})
+            recorder.flush()
+            captured = replay.load_capture(recorder.path)
+        self.assertEqual(captured[0][1].split("?")[0], "/a%20b/id:1")
+        results, seconds = asyncio.run(replay.replay("http://127.0.0.1:5000", captured, 1, 1))
+        self.assertEqual(results[0].status, 201)
+
+
+class TestDispatchIndex(unittest.TestCase):
+    spec = "\n".join(
+        ["PARAM:id /^7$/ text:first seven", "PARAM:id /^x.y$/ text:dot"]
+        + [f"PARAM:id /^{n}$/ text:id {n}" for n in range(10)]
+        + ["PARAM:id /^3/ text:starts with 3", "PARAM:id /^\\$$/ text:dollar", "HEADER:X-Id /^5$/ text:header"]
+        + [f"PARAM:id /^{n}\\.0$/ text:decimal {n}" for n in range(10)]
+        + ["text:none"]
+    )
+
+    def first_match(self, rules, indexes, facets):
+        return next((index for index in indexes if rules[index].apply(facets, 1)), None)
+
+    def test_exact_literal(self):
+        def literal(pattern):
+            rules = compile_rules("", 200, 0, 0, f"PARAM:id {pattern} text:ok").rules
+            return exact_literal(rules[0])
+
+        self.assertEqual([literal("/^12$/"), literal("/^a\\.b$/"), literal("/^$/")], ["12", "a.b", ""])
+        self.assertEqual([literal(p) for p in ("/12/", "/^1.2$/", "/^12$/i", "!/^12$/", "/^12\\$/")], [None] * 5)
+
+    def test_same_rule_as_scanning(self):
+        rules = compile_rules("", 200, 0, 0, self.spec)
+        self.assertEqual(len(rules.index.groups), 1)
+        for value in ["7", "3", "35", "9", "9\n", "x.y", "xzy", "$", "4.0", "4x0", "", "12"]:
+            for header in ["5", "6"]:
+                facets = RequestFacets.of({"X-Id": header}, {"id": value}, Box())
+                self.assertEqual(
+                    self.first_match(rules.rules, rules.index.candidates(facets), facets),
+                    self.first_match(rules.rules, range(len(rules.rules)), facets),
+                )
+
+    def test_fused_run_same_rule_as_scanning(self):
+        spec = "\n".join(
+            [
+                "HEADER:X-Pet /dog/ text:dog",
+                "HEADER:X-Pet /^CAT/i text:cat",
+                "HEADER:X-Pet !/a|o/ text:no vowel",
+                "HEADER:X-Pet /b(ir)d$/ after=10ms text:bird",
+                "HEADER:X-Pet /bird/ text:bird soon",
+                "HEADER:X-Pet /^(\\w)\\1$/ text:double",
+                "HEADER:X-Pet /.+\\d/ text:numbered",
+                "text:other",
+            ]
+        )
+        rules = compile_rules("", 200, 0, 0, spec)
+        self.assertEqual(rules.index.num_runs, 1)
+        for value in [
+            "hotdog",
+            "x" * 40 + "dog",
+            "cats",
+            "Caterpillar",
+            "gnu",
+            "",
+            "bird",
+            "a bird\n",
+            "xx",
+            "cow 2\n3",
+            "dogcat",
+        ]:
+            for millis_since_reset in [5, 50]:
+                facets = RequestFacets.of({"X-Pet": value}, {}, Box())
+
+                def first_match(indexes):
+                    return next((i for i in indexes if rules.rules[i].apply(facets, millis_since_reset)), None)
+
+                self.assertEqual(
+                    first_match(rules.index.candidates(facets)), first_match(range(len(rules.rules))), (value,)
+                )
+
+
+class TestJsonPath(unittest.TestCase):
+    json = {"pet": {"dog": {"name": "Fido", "age": 3}}, "pets": [{"name": "Sue"}, True], "first name": "Al"}
+
+    def test_compile_path(self):
+        self.assertEqual(compile_path("pets[1].name"), ("pets", 1, "name"))
+        self.assertEqual([compile_path(path) for path in (".pet", "pet..dog", "pets[x]")], [None, None, None])
+
+    def test_same_text_as_format(self):
+        for path in ("pet.dog.name", "pet.dog.age", "pet.dog", "pets[0].name", "pets[1]", "pets", "first_name"):
+            self.assertEqual(json_text(self.json, path), ("{json." + path + "}").format(json=Box(self.json)), path)
+        self.assertEqual(json_text(self.json, "pets.0.name"), "Sue")
+
+    def test_missing_field(self):
+        with self.assertRaises(KeyError):
+            json_text(self.json, "pet.cat.name")
+        self.assertEqual(RulesTemplate.resolve_reference("json.pet.cat", RequestFacets.of({}, {}, self.json)), "")
+
+
+class TestJsonStream(unittest.TestCase):
+    json = {"a": 1, "pet": {"dog": {"name": "Fido", "tags": ["x", "y"]}}, "pets": [{"name": "Sue"}, [1, 2]], "z": "}{"}
+    paths = ["a", "pet.dog.name", "pet.dog", "pets[0].name", "pets.0.name", "pets[1][1]", "pets.1", "z", "nope"]
+
+    def test_same_values_as_decoding(self):
+        text = json.dumps(self.json, indent=2)
+        for n in range(len(self.paths)):
+            paths = self.paths[n:] + self.paths[: n // 2]
+            values = JsonExtractor(paths).extract(text)
+            for path in paths:
+                self.assertEqual(values.get(path, missing), walk(self.json, compile_path(path)), path)
+
+    def test_stops_when_all_paths_found(self):
+        self.assertEqual(JsonExtractor(["version"]).extract('{"version": 2, "items": [1, 2 oops'), {"version": 2})
+        with self.assertRaises(ValueError):
+            JsonExtractor(["missing"]).extract('{"version": 2, "items": [1, 2 oops')
+
+    def test_large_body_is_not_decoded(self):
+        body = {"items": list(range(1000)), "version": "2"}
+        with unittest.mock.patch("echoapi.request_facets.json_stream_min_bytes", 1024):
+            with app.test_request_context("/it", json=body):
+                facets = RequestFacets("it")
+                content = RulesTemplate("/it", "JSON:version /2/ text:v{json.version}\ntext:v1").resolve_response(
+                    facets
+                )
+                self.assertEqual((content[3], facets._json), (b"v2\n", None))
+
+
+class TestRequestFacets(unittest.TestCase):
+    def resolve(self, text, **kwargs):
+        with app.test_request_context("/it/id:7", **kwargs):
+            facets = RequestFacets("it/id:7")
+            content = RulesTemplate("/it", text).resolve_response(facets)[3]
+            return content, facets
+
+    def test_static_response_decodes_nothing(self):
+        content, facets = self.resolve("ok", json={"pet": "dog"}, headers={"X-Pet": "cat"})
+        self.assertEqual(content, b"ok")
+        self.assertEqual((facets._headers, facets._params, facets._json, facets._body), (None, None, None, None))
+
+    def test_only_referenced_facets_are_decoded(self):
+        content, facets = self.resolve("JSON:pet /dog/ text:{id} {json.pet}", json={"pet": "dog"})
+        self.assertEqual(content, b"7 dog")
+        self.assertEqual(facets.params, {"id": "7"})
+        self.assertEqual((facets._headers, facets._body), (None, None))
+
+
+class TestIncludeGraph(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.graph = IncludeGraph(ResponseFileStore(self.dir.name, 1000000, 0, 1000000))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def write(self, file, text):
+        with open(os.path.join(self.dir.name, file), "w") as fh:
+            fh.write(text)
+
+    def resolve(self, text, **params):
+        with unittest.mock.patch("echoapi.rules_template.include_graph", self.graph):
+            return RulesTemplate("/it", text).resolve(headers={}, params=params, json=Box())[3]
+
+    def test_cycle_is_rejected_when_loaded(self):
+        self.write("a.echo", "PARAM:x /1/ file:b.echo\ntext:a")
+        self.write("b.echo", "PARAM:z /3/ text:b\nfile:c.echo")
+        self.write("c.echo", "PARAM:y /2/ file:a.echo\ntext:c")
+        with self.assertRaisesRegex(IncludeCycleError, "a.echo -> b.echo -> c.echo -> a.echo"):
+            self.graph.load("a.echo")
+        with self.assertRaises(IncludeCycleError):
+            self.graph.load("c.echo")
+
+        # breaking the cycle lets the files be used again
+        self.write("c.echo", "text:c")
+        self.assertEqual(self.resolve("file:a.echo", x="1"), "c")
+
+    def test_cycle_through_reference_is_rejected_when_used(self):
+        self.write("a.echo", "file:{next}.echo")
+        self.graph.load("a.echo")
+        with self.assertRaises(IncludeCycleError):
+            self.resolve("file:a.echo", next="a")
+
+    def test_invalid_included_file_only_fails_when_used(self):
+        self.write("a.echo", "PARAM:x /1/ file:bad.echo\ntext:ok")
+        self.write("bad.echo", "PARAM:y /(/ text:bad")
+        self.assertEqual(self.resolve("file:a.echo"), "ok")
+        with self.assertRaises(RuleError):
+            self.resolve("file:a.echo", x="1")
+
+    def test_forwarding_chain_is_skipped(self):
+        self.write("a.echo", "file: b.echo")
+        self.write("b.echo", "# just b\nfile:c.echo\n")
+        self.write("c.echo", "PARAM:x /1/ text:c")
+        self.write("d.echo", "202 file:c.echo")
+        self.assertEqual(self.graph.forward("a.echo"), "c.echo")
+        self.assertEqual(self.graph.forward("d.echo"), "d.echo")
+        self.assertEqual(self.resolve("201 file:a.echo", x="1"), "c")
+
+
+class TestWarmUp(unittest.TestCase):
+    def test_warm_up(self):
+        with tempfile.TemporaryDirectory() as root:
+            os.mkdir(os.path.join(root, "pets"))
+            for file, text in [("a.echo", "PARAM:x /1/ text:one\nfile:pets/b.echo"), ("pets/b.echo", "text:b")]:
+                with open(os.path.join(root, file), "w") as fh:
+                    fh.write(text)
+            with open(os.path.join(root, "bad.echo"), "w") as fh:
+                fh.write("PARAM:x /(/ text:y")
+
+            store = ResponseFileStore(root, 1000000, 0, 1000000)
+            cache = RulesCache(10)
+            with unittest.mock.patch.multiple(
+                "echoapi.warm_up", response_files=store, include_graph=IncludeGraph(store), rules_cache=cache
+            ):
+                warm_up = WarmUp(root, 2)
+                warm_up.run()
+
+        self.assertTrue(warm_up.is_ready())
+        self.assertEqual((warm_up.files, list(warm_up.errors)), (3, ["bad.echo"]))
+        self.assertIn("invalid pattern", warm_up.errors["bad.echo"])
+        self.assertEqual(store.stats()["files"], 2)
+        self.assertEqual(cache.stats()["size"], 2)
+        compiled = cache.get(("a.echo", 200, 0, 0, "PARAM:x /1/ text:one\nfile:pets/b.echo", True), None)
+        self.assertEqual(len(compiled.rules), 2)
+
+
+class TestAsgi(unittest.TestCase):
+    async def request(self, query, headers=()):
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {"type": "http", "method": "GET", "path": "/it", "query_string": query.encode(), "headers": headers}
+        await asgi_app(scope, receive, send)
+        return sent[0]["status"], b"".join(message.get("body", b"") for message in sent[1:])
+
+    def test_response(self):
+        status, body = asyncio.run(self.request("_echo_response=201 text:ok"))
+        self.assertEqual((status, body), (201, b"ok"))
+
+    def test_delays_do_not_block(self):
+        async def requests():
+            return await asyncio.gather(*[self.request(f"_echo_response=delay=300ms text:{n}") for n in range(20)])
+
+        start = time.monotonic()
+        responses = asyncio.run(requests())
+        duration = time.monotonic() - start
+
+        self.assertEqual(responses, [(200, str(n).encode()) for n in range(20)])
+        self.assertLess(duration, 0.6)
+
+    def test_app_runs_off_the_event_loop(self):
+        threads = []
+
+        def wsgi_app(environ, start_response):
+            threads.append(threading.current_thread())
+            return app(environ, start_response)
+
+        with unittest.mock.patch.object(asgi_app, "wsgi_app", wsgi_app):
+            status, body = asyncio.run(self.request("_echo_response=text:ok"))
+        self.assertEqual((status, body), (200, b"ok"))
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_repeated_cookie_headers(self):
+        headers = [(b"cookie", b"a=1"), (b"cookie", b"b=2"), (b"x-pet", b"cat"), (b"x-pet", b"dog")]
+        for selector in ("HEADER:Cookie /^a=1; b=2$/", "HEADER:X-Pet /^cat,dog$/"):
+            spec = urllib.parse.quote(f"{selector} text:joined\ntext:not joined")
+            self.assertEqual(asyncio.run(self.request("_echo_response=" + spec, headers)), (200, b"joined\n"))
+
+
+def count_shared_matches(path, num_matches):
+    state = SharedState(path)
+    return [state.next_match("rule") for _ in range(num_matches)]
+
+
+class TestState(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, "state.db")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_local_state(self):
+        state = LocalState()
+        self.assertEqual([state.next_match("a"), state.next_match("a"), state.next_match("b")], [0, 1, 0])
+        state.reset(1234)
+        self.assertEqual((state.last_reset_time(), state.match_counts()), (1234, {}))
+
+    def test_local_state_under_contention(self):
+        state = LocalState()
+        rule_ids = [f"rule{n}" for n in range(4)]
+        offsets = {rule_id: [] for rule_id in rule_ids}
+
+        def hit(rule_id):
+            for _ in range(500):
+                offsets[rule_id].append(state.next_match(rule_id))
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # switch threads as often as possible, to expose any lost update
+        try:
+            threads = [threading.Thread(target=hit, args=(rule_ids[n % 4],)) for n in range(16)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+        # four threads hit each rule 500 times, so each offset from 0 to 1999 is handed out exactly once
+        for rule_id in rule_ids:
+            self.assertEqual(sorted(offsets[rule_id]), list(range(2000)))
+        self.assertEqual(state.match_counts(), {rule_id: 2000 for rule_id in rule_ids})
+
+    def test_shared_state_reset(self):
+        state = SharedState(self.path)
+        state.next_match("a")
+        self.assertEqual((state.last_reset_time(), state.match_counts()), (0, {"a": 1}))
+        SharedState(self.path).reset(1234)
+        self.assertEqual((state.last_reset_time(), state.match_counts()), (1234, {}))
+
+    def test_shared_state_across_processes(self):
+        SharedState(self.path)
+        with multiprocessing.Pool(4) as pool:
+            counts = pool.starmap(count_shared_matches, [(self.path, 50)] * 4)
+        # each match is counted exactly once, whichever worker saw it
+        self.assertEqual(sorted(sum(counts, [])), list(range(200)))